@@ -1,4 +1,5 @@
 from .provider_routes import api as provider_api
 from .client_routes import api as client_api
 from .auth_routes import api as auth_api
+from .admin_routes import api as admin_api
 from .blockchain import blockchain_api
@@ -0,0 +1,32 @@
+"""Routes to run expensive maintenance reports, for signed in users only"""
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from .blockchain import BlockchainDb, get_blockchain, AuditAlreadyRunningError
+from .util import verify_auth_header
+
+
+api = APIRouter(
+    prefix="/api/admin",
+    tags=["admin"],
+    dependencies=[Depends(get_blockchain), Depends(verify_auth_header)],
+    responses={404: {"description": "Not found"}},
+)
+
+@api.get('/audit', status_code=status.HTTP_200_OK)
+def audit(database: BlockchainDb = Depends(get_blockchain)):
+    """Re-hashes the data of every block and reports any mismatches, one run at a time"""
+    try:
+        return database.audit()
+    except AuditAlreadyRunningError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=error.message) from error
+
+@api.get('/validate', status_code=status.HTTP_200_OK)
+def validate(database: BlockchainDb = Depends(get_blockchain)):
+    """Verifies the hash links of the whole chain rather than those added since the last check"""
+    return {'is_valid': database.validate(full=True)}
+
+@api.get('/indexes', status_code=status.HTTP_200_OK)
+def get_index_report(database: BlockchainDb = Depends(get_blockchain)):
+    """Reports missing and unused indexes"""
+    return database.database.get_index_report()
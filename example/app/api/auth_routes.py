@@ -2,7 +2,7 @@ import os
 import uuid
 from pycognito import Cognito
 from fastapi import APIRouter, Depends, status
-from .blockchain import BlockchainDb
+from .blockchain import BlockchainDb, get_blockchain
 from .client_models import Client
 from .provider_models import Provider
 from .util import verify_auth_header
@@ -14,7 +14,7 @@ from .auth_models import RegisterClient, RegisterProvider, SignIn, ConfirmSignUp
 api = APIRouter(
     prefix="/api/auth",
     tags=["authentication"],
-    dependencies=[Depends(BlockchainDb)],
+    dependencies=[Depends(get_blockchain)],
     responses={404: {"description": "Not found"}},
 )
 
@@ -26,7 +26,7 @@ def verify_token():
 
 
 @api.post('/register-client', response_model=str, status_code=status.HTTP_200_OK)
-def register_client(client: RegisterClient, database: BlockchainDb = Depends()):
+def register_client(client: RegisterClient, database: BlockchainDb = Depends(get_blockchain)):
     aws_cognito = Cognito(os.environ['USER_POOL_ID'], os.environ['USER_POOL_WEB_CLIENT_ID'])
 
     aws_cognito.username = client.username
@@ -46,7 +46,7 @@ def register_client(client: RegisterClient, database: BlockchainDb = Depends()):
     return response['UserSub']
 
 @api.post('/register-provider', response_model=str, status_code=status.HTTP_200_OK)
-def register_provider(provider: RegisterProvider, database: BlockchainDb = Depends()):
+def register_provider(provider: RegisterProvider, database: BlockchainDb = Depends(get_blockchain)):
     aws_cognito = Cognito(os.environ['USER_POOL_ID'], os.environ['USER_POOL_WEB_CLIENT_ID'])
 
     aws_cognito.username = provider.username
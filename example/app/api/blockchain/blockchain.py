@@ -1,81 +1,67 @@
 """Implementation of the actual blockchain"""
 
-import asyncio
-import json
 import os
-from datetime import datetime, timezone
-import time
 import logging
-import requests
-import boto3
+import threading
 from injector import inject
-from .mongo import MongoDb
-from .models import Block, ProposedBlock, generate_block, generate_from_proposed_block
+from .mongo import MAX_PAGE_SIZE, MongoDb
+from .cache import chain_head
+from .peers import peer_sessions
+from .membership import membership
+from .audit import audit_chain
+from .async_blockchain import get_async_blockchain
+from .models import Block, ProposedBlock, generate_block
+
+
+MAX_PENDING_LINKS = 1000
+
+_blockchain = None
+_blockchain_lock = threading.Lock()
 
 
 class Blockchain:
-    """Primary class to control the blockchain"""
+    """
+    Primary class to control the blockchain from synchronous code. Commits and reads are
+    those of AsyncBlockchain, run on the shared loop of peer_sessions while the calling
+    thread waits for them; validation and audits of the chain are done here.
+    """
     @inject
     def __init__(self):
         self.database = MongoDb()
-        self.nodes = []
-
-        if 'ENVIRONMENT' not in os.environ or os.environ['ENVIRONMENT'] == 'local' \
-            or os.environ['ENVIRONMENT'] == 'development':
-            if 'NODES' in os.environ and len(os.environ['NODES']) > 0:
-                self.nodes = json.loads(os.environ['NODES'])
-        else:
-            self.nodes = get_aws_nodes()
-
-        logging.info(f'Using nodes: {self.nodes}')
+        self.async_blockchain = get_async_blockchain()
 
-        count = self.database.get_block_count()
-        if count == 0:
-            self.__create_genesis_block()
-
-    def __create_genesis_block(self):
-        """Creates the genesys block for the chain. This should only be called once"""
-        self.__commit(Block([], 'GENISYS', '', '', '', '', '', ''))
+        peer_sessions.run(self.async_blockchain.ensure_genesis_block())
 
     def commit_transaction(self, transaction, block_type, data_collection_name,
-                            data_key_field_name, data_key_value):
-        """Handles the commit for any transaction either create or edit"""
-        retry_count = 3
-        count = 0
-
-        while count < retry_count:
-            new_block = generate_block(transaction, block_type,
-                                       datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %z"),
-                                       self.last_block, data_collection_name, data_key_field_name,
-                                       data_key_value)
-
-            logging.info(f'New block created with hash: {new_block.hash}')
-            is_valid = self.validate_block(new_block)
-
-            if is_valid:
-                self.__commit(new_block)
-                return True
-
-            logging.info('Not enough successful results for block. Block rejected.')
-            count += 1
-            time.sleep(0.1 * count)
-        return False
+                            data_key_field_name, data_key_value, expected_hash_id=None):
+        """
+        Handles the commit for any transaction either create or edit, see
+        AsyncBlockchain.commit_transaction
+        """
+        return peer_sessions.run(self.async_blockchain.commit_transaction(
+            transaction, block_type, data_collection_name, data_key_field_name, data_key_value,
+            expected_hash_id))
 
-    def __commit(self, block: Block):
+    def commit_transactions(self, transactions):
         """
-        Starts the process to add a block to the blockchain
+        Commits several transactions as a run of chained blocks that is conferred with the
+        other nodes in a single round, see AsyncBlockchain.commit_transactions
         """
-        self.database.commit_block(block)
-        return block
+        return peer_sessions.run(self.async_blockchain.commit_transactions(transactions))
 
     def get_proposed_block_hash(self, proposed_block: ProposedBlock):
         """
-        Generates a block that is potentially to be added to the blockchain
+        Generates a block that is potentially to be added to the blockchain. The block is
+        chained onto the head read from the database, see read_head.
         """
-        logging.debug(f'proposed: {proposed_block}')
-        block = generate_from_proposed_block(proposed_block, self.last_block)
-        logging.debug(block)
-        return block.hash
+        return peer_sessions.run(self.async_blockchain.get_proposed_block_hash(proposed_block))
+
+    def get_proposed_block_hashes(self, proposed_blocks):
+        """
+        Generates a run of chained blocks that are potentially to be added to the blockchain,
+        chained onto the head read from the database
+        """
+        return peer_sessions.run(self.async_blockchain.get_proposed_block_hashes(proposed_blocks))
 
     def get_new_block_hash(self, transaction, block_type, timestamp, data_collection_name,
                            data_key_field_name, data_key_value):
@@ -98,111 +84,221 @@ class Blockchain:
         Dispatchs blocks for comparison against other nodes and determines
         the results
         """
-        if len(self.nodes) == 0:
-            return True
+        return peer_sessions.run(self.async_blockchain.validate_block(block))
+
+    def validate_blocks(self, blocks):
+        """
+        Dispatchs a run of chained blocks for comparison against other nodes in one request
+        and determines the results
+        """
+        return peer_sessions.run(self.async_blockchain.validate_blocks(blocks))
 
-        proposed_block = ProposedBlock(**vars(block))
+    def validate(self, full=False):
+        """
+        Validates the blockchain itself to ensure that all nodes are accounted for and in order
+        based upon the links from one block to the next. Similar to traversal of a linked list.
+        Only blocks appended since the last persisted checkpoint are verified unless a full
+        verification is requested or the incremental one fails.
+        """
+        checkpoint = None if full else self.database.get_validation_checkpoint()
+
+        if checkpoint is not None and 'height' in checkpoint:
+            is_valid, last_height, last_hash = verify_hash_links(
+                self.database.get_blockchain_hash_links(checkpoint['height']),
+                checkpoint['hash'])
 
-        logging.info('Starting node conferral process')
-        results = asyncio.run(self.validate_with_other_nodes(proposed_block))
+            if is_valid:
+                self.__save_checkpoint(checkpoint, last_height, last_hash)
+                return True
 
-        logging.info(f'Node conferral results: {results}')
+            logging.warning('Incremental blockchain validation failed, verifying full chain')
 
-        successful_nodes = []
+        is_valid, last_height, last_hash = verify_hash_links(
+            self.database.get_blockchain_hash_links(), '')
 
-        for result in results:
-            logging.info(f'status code: {result.status_code} hash: {result.text}')
-            logging.debug(f'Current hash: {block.hash} Conferral Node hash: {result.text}')
+        if not is_valid:
+            logging.error(f'Blockchain failed to validate after block: {last_hash}')
+            return False
 
-            if result.status_code == 200 and result.text == f'"{block.hash}"':
-                logging.debug('Adding successful validated node')
-                successful_nodes.append(result)
+        self.__save_checkpoint(checkpoint, last_height, last_hash)
+        logging.info(f'Blockchain validated up to block: {last_hash}')
+        return True
 
-        logging.debug(f'Successful Nodes: {len(successful_nodes)}')
-        logging.debug(f'All results: {len(results)}')
-        logging.debug(f'Rate of success: {(len(successful_nodes) / len(results)) + 0.0}')
+    def __save_checkpoint(self, checkpoint, last_height, last_hash):
+        if last_height is not None and (checkpoint is None or last_hash != checkpoint['hash']):
+            self.database.save_validation_checkpoint(last_height, last_hash)
 
-        return ((len(successful_nodes) / len(results)) + 0.0) > 0.75
+    def get_blocks(self, start_height, end_height):
+        """Returns the blocks between the two heights, inclusive, in chain order"""
+        return list(self.database.get_blocks_by_height(start_height, end_height))
 
-    async def validate_with_other_nodes(self, proposed_block):
+    def find_fork(self, start_height=0):
         """
-        Handles the coallation of the block validation requests
+        Walks the chain in height order from start_height and returns the first height at
+        which a block does not link to the block below it, or None if the chain is unbroken
         """
-        logging.debug(f'Using nodes: {self.nodes}')
-
-        outstanding_requests_tasks = [self.validate_with_other_node_request(node, proposed_block)
-                                        for node in self.nodes]
+        previous_link = None
 
-        if len(outstanding_requests_tasks) == 0:
-            return []
+        for link in self.database.get_blockchain_hash_links(start_height - 1):
+            if previous_link is not None and (link['height'] != previous_link['height'] + 1
+                                              or link['previous_hash'] != previous_link['hash']):
+                return link['height']
+            previous_link = link
 
-        return await asyncio.gather(*outstanding_requests_tasks)
+        return None
 
-    async def validate_with_other_node_request(self, node, proposed_block):
+    def audit(self, workers=None, chunk_size=1000):
         """
-        Dispatchs the proposed block for other nodes to confirm the hash is valid
+        Re-hashes every block from the data stored against it, across a process pool, and
+        reports any block whose data no longer matches its hash
         """
-        logging.info(f'Attempting to confirm with node at address: \
-                        {node}/api/blockchain/validate-block and payload: {proposed_block.json()}')
+        return audit_chain(self.database, workers, chunk_size).to_dict()
 
-        return requests.post(f'{node}/api/blockchain/validate-block', data=proposed_block.json())
-
-    def validate(self):
+    def find_one(self, collection_name, query, fields=None):
         """
-        Validates the blockchain itself to ensure that all nodes are accounted for and in order
-        based upon the links from one block to the next. Similar to traversal of a linked list.
+        Wrapper to call to find a single node and its real value in the database. When
+        fields is given only those fields are read and returned, still verified.
         """
-        hash_links = self.database.get_blockchain_hash_links()
-        visited = {}
+        return peer_sessions.run(self.async_blockchain.find_one(collection_name, query, fields))
 
-        if len(hash_links) == 0:
-            return True
+    def find_one_with_hash_id(self, collection_name, query):
+        """
+        Finds a single node and the hash of the block it was committed in, to pass as the
+        expected_hash_id when committing changes made to it
+        """
+        return peer_sessions.run(self.async_blockchain.find_one_with_hash_id(collection_name,
+                                                                             query))
 
-        list_keys = list(hash_links.keys())
-        next_key = hash_links[list_keys[0]]
-        visited[list_keys[0]] = True
-        hash_links.pop(list_keys[0])
+    def find(self, collection_name, query, fields=None):
+        """
+        Wrapper to call to find a multiple nodes and their real values in the database,
+        optionally only the given fields
+        """
+        return peer_sessions.run(self.async_blockchain.find(collection_name, query, fields))
 
-        while next_key != '':
-            tmp_key = hash_links[next_key]
-            hash_links.pop(next_key)
-            next_key = tmp_key
+    def find_iter(self, collection_name, query, fields=None):
+        """
+        Wrapper to stream multiple nodes and their real values from the database without
+        holding them all in memory
+        """
+        return peer_sessions.iterate(self.async_blockchain.find_iter(collection_name, query,
+                                                                     fields))
 
-        if len(hash_links) > 0:
-            logging.error('Blockchain failed to validate at: ')
-            return False
+    def find_one_as_of(self, collection_name, query, at):
+        """
+        Wrapper to find a single node as it was at a block height or a datetime, so past
+        states can be read in one indexed query instead of replaying the chain
+        """
+        return peer_sessions.run(self.async_blockchain.find_one_as_of(collection_name, query, at))
 
-        logging.info(f'Blockchain failed to validate at: {datetime.timestamp()}')
-        return True
+    def get_field_proof(self, collection_name, query, field):
+        """
+        Wrapper to get a proof of a single top level field of a node, verifiable with
+        verify_field_proof against the block hash alone. Needs BLOCK_HASH_VERSION=3.
+        """
+        return peer_sessions.run(self.async_blockchain.get_field_proof(collection_name, query,
+                                                                       field))
 
-    def find_one(self, collection_name, query):
+    def find_history(self, collection_name, data_key_field_name, data_key_value):
         """
-        Wrapper to call to find a single node and its real value in the database
+        Wrapper to iterate over every version of a node, oldest first, as tuples of
+        block height, block timestamp and the document
         """
-        return self.database.find_one(collection_name, query)
+        return peer_sessions.iterate(self.async_blockchain.find_history(
+            collection_name, data_key_field_name, data_key_value))
 
-    def find(self, collection_name, query):
+    def find_page(self, collection_name, query, limit=MAX_PAGE_SIZE, page_token=None,
+                  fields=None):
         """
-        Wrapper to call to find a multiple nodes and their real values in the database
+        Wrapper to find a page of nodes and the token to continue from with the next page
         """
-        return self.database.find(collection_name, query)
+        return peer_sessions.run(self.async_blockchain.find_page(collection_name, query, limit,
+                                                                 page_token, fields))
 
     @property
     def last_block(self):
-        return self.database.get_latest_hash()
-
-
-def get_aws_nodes():
-    client = boto3.client('servicediscovery')
-    metadata_uri = os.environ['ECS_CONTAINER_METADATA_URI']
-    container_metadata = requests.get(metadata_uri).json()
-    container_ip = container_metadata['Networks'][0]['IPv4Addresses'][0]
-    node_ips = []
-    for service in client.list_services()['Services']:
-        for instance in client.list_instances(
-            ServiceId=service['Id'],
-            MaxResults=100
-        )['Instances']:
-            if container_ip != instance['Attributes']['AWS_INSTANCE_IPV4']:
-                node_ips.append(instance['Attributes']['AWS_INSTANCE_IPV4'])
-    return node_ips
+        """Hash of the head of the chain, served from the in process chain head cache"""
+        return self.head[0]
+
+    def read_head(self):
+        """
+        Reads the head from the database and refreshes the cached head with it, see
+        AsyncBlockchain.read_head
+        """
+        return peer_sessions.run(self.async_blockchain.read_head())
+
+    @property
+    def head(self):
+        """Hash and height of the head of the chain"""
+        return peer_sessions.run(self.async_blockchain.get_head())
+
+    @property
+    def nodes(self):
+        """Every node in the current membership snapshot"""
+        return membership.nodes
+
+
+def start_chain_head_watcher():
+    """
+    Starts pushing chain head updates from a change stream on the blocks collection when
+    CHAIN_HEAD_WATCH is enabled. Falls back to the ttl refresh if the stream is unavailable.
+    """
+    if os.environ.get('CHAIN_HEAD_WATCH', 'false').lower() != 'true':
+        return
+
+    try:
+        chain_head.start_watching(MongoDb().watch_blocks)
+    except Exception as error:
+        logging.warning(f'Unable to watch blocks for chain head updates: {error}')
+
+
+def stop_chain_head_watcher():
+    chain_head.stop_watching()
+
+
+def get_blockchain():
+    """
+    App scoped dependency returning the Blockchain shared by every request in the process.
+    The genesis check runs once, when it is first created.
+    """
+    global _blockchain
+
+    if _blockchain is None:
+        with _blockchain_lock:
+            if _blockchain is None:
+                _blockchain = Blockchain()
+
+    return _blockchain
+
+
+def close_blockchain():
+    """Shutdown hook to drop the shared Blockchain"""
+    global _blockchain
+
+    with _blockchain_lock:
+        _blockchain = None
+
+
+def verify_hash_links(hash_links, last_hash):
+    """
+    Walks hash links, in height order, forward from the block with last_hash and checks
+    each block follows on from the one before it. Blocks that arrive ahead of their
+    predecessor are held until it is seen, up to MAX_PENDING_LINKS, so memory stays bounded
+    regardless of the length of the chain. Returns whether the links are valid along with
+    the height and hash of the last block verified.
+    """
+    pending_links = {}
+    last_height = None
+
+    for link in hash_links:
+        last_height = link.get('height', last_height)
+
+        if link['previous_hash'] in pending_links or len(pending_links) >= MAX_PENDING_LINKS:
+            return False, last_height, last_hash
+
+        pending_links[link['previous_hash']] = link['hash']
+
+        while last_hash in pending_links:
+            last_hash = pending_links.pop(last_hash)
+
+    return len(pending_links) == 0, last_height, last_hash
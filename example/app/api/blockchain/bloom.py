@@ -0,0 +1,97 @@
+"""In process Bloom filters of the keys that already have a CREATE block"""
+
+import os
+import math
+import hashlib
+import threading
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings. A key that was added is always reported as present, a key
+    that was not is reported as present with a probability of about error_rate once capacity
+    keys have been added.
+    """
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.__bits = bytearray((self.size + 7) // 8)
+        self.__lock = threading.Lock()
+
+    def add(self, key):
+        positions = list(self.__get_positions(key))
+
+        with self.__lock:
+            for position in positions:
+                self.__bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.__bits[position >> 3] & (1 << (position & 7))
+                   for position in self.__get_positions(key))
+
+    def __get_positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((first + index * second) % self.size for index in range(self.hash_count))
+
+
+class KeyFilters:
+    """
+    Bloom filter per data collection of the keys that have a CREATE block, loaded from the
+    DataKeys collection at startup and kept up to date with the CREATE blocks committed by
+    this process. A key reported as missing has not been created by this process nor before
+    the filter was loaded; the unique DataKeys index stays the authority for the rest.
+    """
+    def __init__(self, capacity=100000, error_rate=0.01, enabled=True):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.enabled = enabled
+        self.__filters = {}
+
+    def load(self, collection_name, keys, key_count=0):
+        """Replaces the filter of the collection with one holding the keys"""
+        if not self.enabled:
+            return
+
+        bloom_filter = BloomFilter(max(self.capacity, 2 * key_count), self.error_rate)
+
+        for key in keys:
+            bloom_filter.add(key)
+
+        self.__filters[collection_name] = bloom_filter
+
+    def add(self, collection_name, key):
+        bloom_filter = self.__filters.get(collection_name)
+
+        if bloom_filter is not None:
+            bloom_filter.add(str(key))
+
+    def might_contain(self, collection_name, key):
+        """
+        False only when the key certainly has no CREATE block known to this process. True
+        when it may have one or when no filter is loaded for the collection.
+        """
+        bloom_filter = self.__filters.get(collection_name)
+
+        if bloom_filter is None:
+            return True
+
+        return str(key) in bloom_filter
+
+    def clear(self):
+        self.__filters = {}
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the filters from KEY_FILTER_CAPACITY, KEY_FILTER_ERROR_RATE and
+        KEY_FILTER_ENABLED. Setting KEY_FILTER_ENABLED to false opts out of the filters.
+        """
+        return cls(int(os.environ.get('KEY_FILTER_CAPACITY', 100000)),
+                   float(os.environ.get('KEY_FILTER_ERROR_RATE', 0.01)),
+                   os.environ.get('KEY_FILTER_ENABLED', 'true').lower() != 'false')
+
+
+key_filters = KeyFilters.from_environment()
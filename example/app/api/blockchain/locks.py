@@ -0,0 +1,59 @@
+"""In process locks serializing commits to the same document"""
+
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyLockTable:
+    """
+    Table of asyncio locks keyed by (collection, key) so commits to the same document in this
+    process run one at a time while commits to other documents proceed. An entry lives only
+    while a commit holds or waits on it. Every commit runs on the shared loop of
+    peer_sessions, so the table is only used from that loop.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.__entries = {}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @asynccontextmanager
+    async def hold_async(self, key):
+        """Holds the lock for the key for the duration of the block"""
+        if not self.enabled:
+            yield
+            return
+
+        lock = self.__acquire_entry(key)
+        try:
+            async with lock:
+                yield
+        finally:
+            self.__release_entry(key)
+
+    def __acquire_entry(self, key):
+        entry = self.__entries.get(key)
+
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self.__entries[key] = entry
+
+        entry[1] += 1
+        return entry[0]
+
+    def __release_entry(self, key):
+        entry = self.__entries[key]
+        entry[1] -= 1
+
+        if entry[1] == 0:
+            del self.__entries[key]
+
+    @classmethod
+    def from_environment(cls):
+        """Setting COMMIT_KEY_LOCKS_ENABLED to false opts out of serializing commits per key"""
+        return cls(os.environ.get('COMMIT_KEY_LOCKS_ENABLED', 'true').lower() != 'false')
+
+
+commit_locks = KeyLockTable.from_environment()
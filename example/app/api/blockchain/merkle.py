@@ -0,0 +1,100 @@
+"""Merkle trees over the top level fields of block data, to prove single fields of a document"""
+
+import json
+from hashlib import sha256
+from .encoder import HelperEncoder
+
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+PROOF_LEFT = 'L'
+PROOF_RIGHT = 'R'
+
+
+def get_leaf_hash(name, value):
+    """Hash of a field of the data covering its name and the canonical json of its value"""
+    serialized = json.dumps([name, value], sort_keys=True, separators=(',', ':'),
+                            cls=HelperEncoder)
+    return sha256(LEAF_PREFIX + serialized.encode()).hexdigest()
+
+
+def get_node_hash(left, right):
+    return sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def get_data_leaves(data):
+    """
+    Field names and leaf hashes of the data ordered by name. Data that is not a document,
+    like that of the genesis block, is a single unnamed leaf.
+    """
+    if not isinstance(data, dict):
+        return [(None, get_leaf_hash(None, data))]
+
+    return [(name, get_leaf_hash(name, data[name])) for name in sorted(data)]
+
+
+def build_merkle_tree(leaf_hashes):
+    """
+    Levels of the tree from the leaves up to the root. A node without a sibling is carried
+    up to the next level unchanged.
+    """
+    levels = [list(leaf_hashes)]
+
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([get_node_hash(level[index], level[index + 1])
+                       if index + 1 < len(level) else level[index]
+                       for index in range(0, len(level), 2)])
+
+    return levels
+
+
+def get_merkle_root(data):
+    """Root of the tree over the fields of the data, the hash of no bytes for empty data"""
+    levels = build_merkle_tree(leaf_hash for _, leaf_hash in get_data_leaves(data))
+
+    if len(levels[-1]) == 0:
+        return sha256(b'').hexdigest()
+    return levels[-1][0]
+
+
+def get_inclusion_proofs(data):
+    """
+    Proof per top level field of the data: the sibling hashes on the path from its leaf up
+    to the root, each with the side of the path it is on
+    """
+    leaves = get_data_leaves(data)
+    levels = build_merkle_tree(leaf_hash for _, leaf_hash in leaves)
+    proofs = {}
+
+    for index, (name, _) in enumerate(leaves):
+        proof = []
+        position = index
+
+        for level in levels[:-1]:
+            sibling = position ^ 1
+
+            if sibling < len(level):
+                proof.append([PROOF_LEFT if sibling < position else PROOF_RIGHT, level[sibling]])
+            position //= 2
+
+        proofs[name] = proof
+
+    return proofs
+
+
+def get_root_from_proof(leaf_hash, proof):
+    node = leaf_hash
+
+    for side, sibling in proof:
+        node = get_node_hash(sibling, node) if side == PROOF_LEFT else get_node_hash(node, sibling)
+
+    return node
+
+
+def verify_inclusion_proof(name, value, proof, data_root):
+    """Whether the field name holding value is part of the data committed to by data_root"""
+    try:
+        return get_root_from_proof(get_leaf_hash(name, value), proof) == data_root
+    except (ValueError, TypeError):
+        return False
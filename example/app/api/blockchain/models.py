@@ -1,64 +1,186 @@
+import os
 import uuid
 import json
 import logging
 from hashlib import sha256
 from datetime import datetime
+from json.encoder import encode_basestring_ascii
 from pydantic import BaseModel
-from ..util import HelperEncoder
+from .encoder import HelperEncoder
+from .merkle import get_merkle_root, get_inclusion_proofs, verify_inclusion_proof
+
+
+HASH_VERSION_LEGACY = 1
+HASH_VERSION_CANONICAL = 2
+HASH_VERSION_MERKLE = 3
+CURRENT_HASH_VERSION = int(os.environ.get('BLOCK_HASH_VERSION', HASH_VERSION_CANONICAL))
+
+BLOCK_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+DATA_BLOCK_METADATA_FIELDS = ('block_height', 'block_timestamp', 'data_proofs')
+
+
+def parse_block_timestamp(timestamp):
+    """Returns the block timestamp as a datetime, or None if it is not in the block format"""
+    try:
+        return datetime.strptime(timestamp, BLOCK_TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_canonical_value(value):
+    encoder = CANONICAL_ENCODERS.get(type(value))
+
+    if encoder is None:
+        return json.dumps(value, sort_keys=True, separators=(',', ':'), cls=HelperEncoder)
+
+    return encoder(value)
+
+
+CANONICAL_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: float.__repr__,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null',
+}
+
+
+def serialize_block_for_hash(id, block_type, timestamp, previous_hash, data, hash_version):
+    """
+    Serializes the hashed fields of a block. Version 1 is the original format, the json
+    dump of the fields with the already serialized data escaped as a string. Version 2
+    writes the fields in a fixed order and embeds the serialized data as is. Version 3 is
+    version 2 with data replaced by the Merkle root of the fields of the data, so a single
+    field can be proven against the block hash without the rest of the data.
+    """
+    if hash_version == HASH_VERSION_LEGACY:
+        return json.dumps({'id': id, 'block_type': block_type, 'timestamp': timestamp,
+                           'previous_hash': previous_hash, 'data': data},
+                          sort_keys=True, cls=HelperEncoder)
+
+    if hash_version == HASH_VERSION_MERKLE:
+        return ''.join(('{"block_type":', encode_canonical_value(block_type),
+                        ',"data_root":', encode_canonical_value(data),
+                        ',"id":', encode_canonical_value(id),
+                        ',"previous_hash":', encode_canonical_value(previous_hash),
+                        ',"timestamp":', encode_canonical_value(timestamp),
+                        ',"v":3}'))
+
+    if hash_version != HASH_VERSION_CANONICAL:
+        raise ValueError(f'Unknown block hash version: {hash_version}')
+
+    return ''.join(('{"block_type":', encode_canonical_value(block_type),
+                    ',"data":', data,
+                    ',"id":', encode_canonical_value(id),
+                    ',"previous_hash":', encode_canonical_value(previous_hash),
+                    ',"timestamp":', encode_canonical_value(timestamp),
+                    ',"v":2}'))
 
 
 class Block:
+    __slots__ = ('id', 'block_type', 'timestamp', 'previous_hash', 'data', 'hash', 'hash_version',
+                 'data_collection_name', 'data_key_field_name', 'data_key_value', 'superceded',
+                 'height', 'data_root')
+
     def __init__(self, id, data, block_type, timestamp: datetime, previous_hash,
-                    data_collection_name, data_key_field_name, data_key_value):
+                    data_collection_name, data_key_field_name, data_key_value, height=None,
+                    hash_version=CURRENT_HASH_VERSION):
         self.id = id
         self.block_type = block_type
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.data = json.dumps(data, cls=HelperEncoder)
+        self.data_root = get_merkle_root(json.loads(self.data)) \
+            if hash_version == HASH_VERSION_MERKLE else None
+
+        serialized_block = serialize_block_for_hash(
+            id, block_type, timestamp, previous_hash,
+            self.data if self.data_root is None else self.data_root, hash_version)
 
-        logging.debug(json.dumps(self.__dict__, sort_keys=True, cls=HelperEncoder))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(serialized_block)
 
-        self.hash = sha256(json.dumps(self.__dict__, sort_keys=True, cls=HelperEncoder).encode()) \
-                        .hexdigest()
+        self.hash = sha256(serialized_block.encode()).hexdigest()
+        self.hash_version = hash_version
         self.data_collection_name = data_collection_name
         self.data_key_field_name = data_key_field_name
         self.data_key_value = data_key_value
         self.superceded = False
+        self.height = height
 
     def get_naked_block(self):
-        return NakedBlock(self.id, self.timestamp, self.block_type, self.hash, self.previous_hash)
+        return NakedBlock(self)
 
     def get_data_block(self):
-        return DataBlock(self.timestamp, self.data_collection_name,
-                            self.data, self.hash, self.block_type, self.superceded)
+        return DataBlock(self)
+
+    def get_proposed_block(self):
+        return ProposedBlock(id=self.id, block_type=self.block_type, timestamp=self.timestamp,
+                             data=self.data, data_collection_name=self.data_collection_name,
+                             data_key_field_name=self.data_key_field_name,
+                             data_key_value=self.data_key_value, hash_version=self.hash_version)
+
+
+def block_field(name):
+    """Read only property of a block view that reads the field from the underlying block"""
+    return property(lambda view: getattr(view.block, name))
 
 
 class NakedBlock:
-    def __init__(self, id, timestamp, block_type, hash, previous_hash):
-        self.id = id
-        self.block_type = block_type
-        self.timestamp = timestamp
-        self.previous_hash = previous_hash
-        self.hash = hash
+    """View of the fields of a block that are stored in the blocks collection"""
+    __slots__ = ('block',)
+
+    id = block_field('id')
+    block_type = block_field('block_type')
+    timestamp = block_field('timestamp')
+    previous_hash = block_field('previous_hash')
+    hash = block_field('hash')
+    height = block_field('height')
+    hash_version = block_field('hash_version')
+    data_root = block_field('data_root')
+
+    def __init__(self, block: Block):
+        self.block = block
+
+    def get_document(self):
+        block = self.block
+        document = {'id': block.id, 'block_type': block.block_type, 'timestamp': block.timestamp,
+                    'previous_hash': block.previous_hash, 'hash': block.hash,
+                    'height': block.height, 'hash_version': block.hash_version}
+
+        if block.data_root is not None:
+            document['data_root'] = block.data_root
+        return document
 
 
 class DataBlock:
-    def __init__(self, timestamp, data_collection_name, data, hash, block_type, superceded):
-        self.timestamp = timestamp
-        self.collection = data_collection_name
-        self.block_type = block_type
-        self.data = data
-        self.superceded = superceded
-        self.hash = hash
+    """View of the fields of a block that are stored in its data collection"""
+    __slots__ = ('block',)
+
+    timestamp = block_field('timestamp')
+    collection = block_field('data_collection_name')
+    block_type = block_field('block_type')
+    data = block_field('data')
+    superceded = block_field('superceded')
+    hash = block_field('hash')
+
+    def __init__(self, block: Block):
+        self.block = block
 
     def set_superceded(self):
-        self.superceded = True
+        self.block.superceded = True
 
     def get_document(self):
-        document = json.loads(self.data)
-        document['hash_id'] = self.hash
-        document['block_type'] = self.block_type
-        document['superceded'] = self.superceded
+        document = json.loads(self.block.data)
+
+        if self.block.data_root is not None:
+            document['data_proofs'] = get_inclusion_proofs(document)
+
+        document['hash_id'] = self.block.hash
+        document['block_type'] = self.block.block_type
+        document['superceded'] = self.block.superceded
+        document['block_height'] = self.block.height
+        document['block_timestamp'] = parse_block_timestamp(self.block.timestamp)
         return document
 
 
@@ -81,20 +203,44 @@ class ProposedBlock(BaseModel):
     data_collection_name: str
     data_key_field_name: str
     data_key_value: str
+    hash_version: int = HASH_VERSION_LEGACY
 
 
 def generate_block(data, block_type, timestamp: datetime, previous_hash,
-                    data_collection_name, data_key_field_name, data_key_value):
+                    data_collection_name, data_key_field_name, data_key_value, height=None):
     return Block(uuid.uuid4().hex, data, block_type, timestamp, previous_hash,
-                    data_collection_name, data_key_field_name, data_key_value)
+                    data_collection_name, data_key_field_name, data_key_value, height)
 
-def generate_audit_block(id, data, block_type, timestamp: datetime, previous_hash):
+def generate_audit_block(id, data, block_type, timestamp: datetime, previous_hash,
+                         hash_version=HASH_VERSION_LEGACY):
     del data["hash_id"]
-    return Block(id, data, block_type, timestamp, previous_hash, '', '', '')
+    return Block(id, data, block_type, timestamp, previous_hash, '', '', '',
+                 hash_version=hash_version)
 
 
 def generate_from_proposed_block(proposed_block: ProposedBlock, previous_hash):
     return Block(proposed_block.id, json.loads(proposed_block.data),
                  proposed_block.block_type, proposed_block.timestamp, previous_hash,
                  proposed_block.data_collection_name, proposed_block.data_key_field_name,
-                 proposed_block.data_key_value)
+                 proposed_block.data_key_value, hash_version=proposed_block.hash_version)
+
+
+def get_merkle_block_hash(block):
+    """Recomputes the hash of a stored version 3 block from its fields and data root alone"""
+    return sha256(serialize_block_for_hash(block['id'], block['block_type'], block['timestamp'],
+                                           block['previous_hash'], block['data_root'],
+                                           HASH_VERSION_MERKLE).encode()).hexdigest()
+
+
+def verify_field_proof(field_proof):
+    """
+    Verifies a field proof as returned by MongoDb.get_field_proof: the value of the field is
+    part of the data committed to by the data root of the block, and the block hash covers
+    that data root. Needs nothing but the proof, so it can be checked by a third party.
+    """
+    block = field_proof['block']
+
+    return block.get('hash_version') == HASH_VERSION_MERKLE \
+        and get_merkle_block_hash(block) == block['hash'] \
+        and verify_inclusion_proof(field_proof['field'], field_proof['value'],
+                                   field_proof['proof'], block['data_root'])
@@ -1,130 +1,836 @@
 """Class to handle mongodb database"""
 
 import os
+import json
+import base64
+import binascii
 import logging
-from pymongo import MongoClient
-from .models import Block, generate_audit_block
+import threading
+from datetime import datetime, timezone
+from pymongo import MongoClient, InsertOne, UpdateMany, UpdateOne, IndexModel, ASCENDING, \
+    DESCENDING
+from bson import ObjectId
+from bson.errors import InvalidId
+from .models import Block, HASH_VERSION_LEGACY, HASH_VERSION_MERKLE, CURRENT_HASH_VERSION, \
+    DATA_BLOCK_METADATA_FIELDS, generate_audit_block, parse_block_timestamp, get_merkle_block_hash
+from .merkle import verify_inclusion_proof
+from .cache import audit_cache
+from .bloom import key_filters
+
+
+_MISSING = object()
+
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 1000))
+MAX_PAGE_SIZE = int(os.environ.get('FIND_MAX_PAGE_SIZE', 1000))
+HASH_LINK_BATCH_SIZE = 1000
+MERKLE_BLOCK_FIELDS = ('id', 'block_type', 'timestamp', 'previous_hash', 'data_root', 'hash',
+                       'hash_version', 'height')
+INTERNAL_COLLECTIONS = ('Blocks', 'ValidationCheckpoints', 'DataKeys')
+
+ILLEGAL_OPERATION_ERROR_CODE = 20
+
+_transactions_supported = os.environ.get('MONGO_TRANSACTIONS', 'true').lower() != 'false'
+_clients = {}
+_clients_lock = threading.Lock()
+_registered_collections = {}
+_indexed_collections = set()
+
+BLOCK_INDEXES = [
+    IndexModel([('hash', ASCENDING)], unique=True),
+    IndexModel([('height', ASCENDING)], unique=True,
+               partialFilterExpression={'height': {'$type': 'number'}}),
+]
+
+DATA_KEY_INDEXES = [
+    IndexModel([('collection', ASCENDING), ('key', ASCENDING)], unique=True),
+]
+
+
+def get_data_collection_indexes(data_key_field_name):
+    """
+    Indexes needed to look up the documents of a data collection by their key field, and by
+    the hash of their block when auditing the chain
+    """
+    return [
+        IndexModel([('hash_id', ASCENDING)]),
+        IndexModel([(data_key_field_name, ASCENDING), ('superceded', ASCENDING)]),
+        IndexModel([(data_key_field_name, ASCENDING), ('block_type', ASCENDING)]),
+        IndexModel([(data_key_field_name, ASCENDING)],
+                   partialFilterExpression={'superceded': False},
+                   name=f'{data_key_field_name}_1_current'),
+        IndexModel([(data_key_field_name, ASCENDING), ('block_timestamp', DESCENDING)]),
+        IndexModel([(data_key_field_name, ASCENDING), ('block_height', DESCENDING)]),
+    ]
+
+
+def register_collection(data_collection_name, data_key_field_name):
+    """
+    Registers a data collection and its key field so its indexes are ensured at startup.
+    Collections are also registered automatically the first time a block is committed to them.
+    """
+    _registered_collections[data_collection_name] = data_key_field_name
 
 
-class CreateBlockAlreadyExistsError(Exception):
-    def __init__(self, data_key_field_name, data_key_value):
-        self.message = f'Block of type CREATE cannot be created. \
-                        Key: {data_key_field_name} and Id: {data_key_value} already exists'
+def get_client_settings():
+    """
+    Builds the keyword arguments for the shared MongoClient from the environment. Only
+    settings that are present are passed through so the driver defaults still apply.
+    """
+    int_settings = {
+        'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+        'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+        'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+        'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+        'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+        'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+        'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    }
+    settings = {}
 
+    for env_name, setting_name in int_settings.items():
+        if env_name in os.environ and len(os.environ[env_name]) > 0:
+            settings[setting_name] = int(os.environ[env_name])
 
-class MongoDb:
+    if 'MONGO_READ_PREFERENCE' in os.environ and len(os.environ['MONGO_READ_PREFERENCE']) > 0:
+        settings['readPreference'] = os.environ['MONGO_READ_PREFERENCE']
+
+    return settings
+
+
+def get_connection_settings():
+    """Returns the connection string and database name from the environment"""
+    if 'CONNECTION_STRING' not in os.environ:
+        raise ValueError('CONNECTION_STRING is required as an environment variable')
+
+    if 'DATABASE' not in os.environ:
+        raise ValueError('DATABASE is required as an environment variable')
+
+    return os.environ['CONNECTION_STRING'], os.environ['DATABASE']
+
+
+def get_client(connection_string):
     """
-    Wrapper for mongodb and performs some basic operations on the database
+    Returns the process wide MongoClient for the connection string, creating it on first
+    use. MongoClient is thread safe and owns its own connection pool so it is shared by
+    every MongoDb instance in the process.
     """
-    def __init__(self):
-        if 'CONNECTION_STRING' in os.environ:
-            self.connection_string = os.environ['CONNECTION_STRING']
-        else:
-            raise ValueError('CONNECTION_STRING is required as an environment variable')
+    client = _clients.get(connection_string)
 
-        if 'DATABASE' in os.environ:
-            self.database_name = os.environ['DATABASE']
-        else:
-            raise ValueError('DATABASE is required as an environment variable')
+    if client is not None:
+        return client
 
-    def get_latest_hash(self):
-        latest_block = self.__get_database().Blocks.find_one({}, sort=[('_id', -1)])
+    with _clients_lock:
+        if connection_string not in _clients:
+            logging.info('Creating shared MongoClient connection pool')
+            _clients[connection_string] = MongoClient(connection_string, **get_client_settings())
+        return _clients[connection_string]
 
-        if latest_block is None:
-            return ''
 
-        return latest_block['hash']
+def open_connection_pool():
+    """
+    Startup hook to create the shared connection pool before the first request is served
+    """
+    if 'CONNECTION_STRING' not in os.environ:
+        raise ValueError('CONNECTION_STRING is required as an environment variable')
 
-    def commit_block(self, block: Block):
-        database = self.__get_database()
-        naked_block = block.get_naked_block()
+    return get_client(os.environ['CONNECTION_STRING'])
 
-        if database.Blocks.count() == 0:
-            logging.info("Genisys block created")
-            database.Blocks.insert_one(vars(naked_block))
-            return
 
-        data_block = block.get_data_block()
-        data_key_value = str(block.data_key_value)
+def close_connection_pool():
+    """
+    Shutdown hook to close every shared MongoClient and release its pooled connections
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def ensure_indexes():
+    """
+    Startup hook to give any block without one a height, copy the height and timestamp of
+    their block onto data documents committed before they were stored there, create any
+    missing index on the blocks collection and on every registered data collection and load
+    the key filters of those collections
+    """
+    database = MongoDb()
+    database.backfill_block_heights()
+    database.backfill_data_block_metadata()
+    database.ensure_indexes()
+
+
+def are_transactions_supported():
+    return _transactions_supported
+
+
+def disable_transactions():
+    """Falls back to writes without a transaction for the rest of the process"""
+    global _transactions_supported
+    logging.warning('Transactions are not supported by the database, '
+                    'falling back to ordered bulk writes')
+    _transactions_supported = False
+
+
+def needs_collection_indexes(data_collection_name):
+    return data_collection_name not in _indexed_collections
 
-        existing_block_query = {block.data_key_field_name: data_key_value, "block_type": 'CREATE'}
-        existing_collection_block_result = list(self.__get_database()[data_block.collection]
-                                            .find(filter=existing_block_query))
 
-        if len(existing_collection_block_result) > 0 and block.block_type == 'CREATE':
-            raise CreateBlockAlreadyExistsError(block.data_key_field_name, data_key_value)
+def mark_collection_indexed(data_collection_name):
+    _indexed_collections.add(data_collection_name)
 
-        existing_block_query_updated = {"$set": {"superceded": True}}
-        database[data_block.collection].update({block.data_key_field_name: data_key_value},
-                                                existing_block_query_updated, multi=True)
 
-        database.Blocks.insert_one(vars(naked_block))
-        database[data_block.collection].insert_one(data_block.get_document())
+def get_data_key_query(data_collection_name, data_key_value):
+    return {'collection': data_collection_name, 'key': str(data_key_value)}
+
+
+def get_data_key_document(block: Block):
+    """
+    Entry of the DataKeys collection recording the key of a CREATE block. The unique index
+    on the collection and key makes inserting it the check that the key was not created yet.
+    """
+    return {**get_data_key_query(block.data_collection_name, block.data_key_value),
+            'hash_id': block.hash}
+
+
+def get_current_document_query(data_key_field_name, data_key_value):
+    return {data_key_field_name: str(data_key_value), "superceded": False}
+
+
+def check_expected_hash_id(block: Block, current_document, expected_hash_id):
+    """
+    Raises a CommitConflictError when the current document for the key of the block is not
+    the one at expected_hash_id
+    """
+    current_hash_id = None if current_document is None else current_document['hash_id']
+
+    if current_hash_id != expected_hash_id:
+        raise CommitConflictError(block.data_collection_name, block.data_key_value,
+                                  expected_hash_id, current_hash_id)
 
-    def get_block_count(self):
+
+def get_data_write_operations(block: Block):
+    """
+    Ordered writes to the data collection that supercede the current data for the key of
+    the block and insert the data of the block
+    """
+    return [
+        UpdateMany(get_current_document_query(block.data_key_field_name, block.data_key_value),
+                   {"$set": {"superceded": True}}),
+        InsertOne(block.get_data_block().get_document())
+    ]
+
+
+def get_cached_verified_results(query_results):
+    """
+    Identities of the results holding exactly the document recently verified for their
+    hash_id. A row is only accepted from the cache when its content is the content that was
+    verified, not merely because it carries a verified hash_id.
+    """
+    verified_results = set()
+
+    for result in query_results:
+        document = audit_cache.get(result['hash_id'])
+
+        if document is not None and document == {name: value for name, value in result.items()
+                                                 if name != 'hash_id'}:
+            verified_results.add(id(result))
+
+    return verified_results
+
+
+def get_cached_verified_projections(query_results, fields):
+    """
+    Identities of the projected results whose top level fields holding the fields are those
+    of the document recently verified for their hash_id
+    """
+    verified_results = set()
+
+    for result in query_results:
+        document = audit_cache.get(result['hash_id'])
+
+        if document is not None and all(
+                document.get(name, _MISSING) == result[name] if name in result
+                else name not in document
+                for name in get_top_level_fields(fields)):
+            verified_results.add(id(result))
+
+    return verified_results
+
+
+def verify_query_results(query_results, blocks, verified_results):
+    """
+    Verifies each query result against the block it references, keyed by hash in blocks.
+    Results whose identity is in verified_results match a recently verified document and
+    are accepted as is.
+    """
+    results = []
+
+    for result in query_results:
+        hash_id = result['hash_id']
+
+        if id(result) in verified_results:
+            del result['hash_id']
+            results.append(result)
+            continue
+
+        block = blocks.get(hash_id)
+
+        if block is None:
+            logging.warning(f'No block found for hash: {hash_id}')
+            continue
+
+        audit_block = generate_audit_block(block['id'], result, block['block_type'],
+                         block['timestamp'], block['previous_hash'],
+                         block.get('hash_version', HASH_VERSION_LEGACY))
+
+        if audit_block.hash == block['hash']:
+            audit_cache.set(hash_id, json.loads(audit_block.data))
+            results.append(result)
+
+    return results
+
+
+def encode_page_token(last_id):
+    """Opaque continuation token for the page following the document with _id last_id"""
+    return base64.urlsafe_b64encode(last_id.binary).decode()
+
+
+def decode_page_token(page_token):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(page_token.encode()))
+    except (binascii.Error, InvalidId, TypeError, ValueError) as error:
+        raise InvalidPageTokenError(page_token) from error
+
+
+def get_page_query(query, page_token):
+    """Restricts the query to the documents after the page token, newest first"""
+    if page_token is None:
+        return dict(query)
+    return {**query, '_id': {'$lt': decode_page_token(page_token)}}
+
+
+def get_page_size(limit):
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def get_projection(fields):
+    """
+    Server side projection returning only the top level fields holding the fields, plus
+    what is needed to audit them: the block hash and, for Merkle blocks, their field proofs
+    """
+    if fields is None:
+        return {'block_type': 0}
+
+    names = get_top_level_fields(fields)
+    return {**{name: 1 for name in names}, **{f'data_proofs.{name}': 1 for name in names},
+            'hash_id': 1}
+
+
+def is_projected_on_server(fields):
+    """
+    Whether a find of the fields reads only those fields. Only version 3 blocks can be
+    verified from a projection, so while other blocks are committed the full documents are
+    read once, audited and then projected, rather than read again by _id after a projection.
+    """
+    return fields is not None and CURRENT_HASH_VERSION == HASH_VERSION_MERKLE
+
+
+def get_top_level_fields(fields):
+    return list(dict.fromkeys(field.split('.')[0] for field in fields))
+
+
+def project_value(value, path):
+    """
+    Returns the part of value at the dotted path split into path, following arrays of
+    documents the way a MongoDB projection does, or _MISSING
+    """
+    if len(path) == 0:
+        return value
+
+    if isinstance(value, list):
+        projected_items = [project_value(item, path) for item in value if isinstance(item, dict)]
+        return [{} if item is _MISSING else item for item in projected_items]
+
+    if not isinstance(value, dict) or path[0] not in value:
+        return _MISSING
+
+    projected = project_value(value[path[0]], path[1:])
+
+    if projected is _MISSING:
+        return {} if len(path) > 1 and isinstance(value[path[0]], dict) else _MISSING
+    return {path[0]: projected}
+
+
+def merge_projections(first, second):
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged = dict(first)
+        for key, value in second.items():
+            merged[key] = merge_projections(merged[key], value) if key in merged else value
+        return merged
+
+    if isinstance(first, list) and isinstance(second, list):
+        return [merge_projections(*items) for items in zip(first, second)]
+
+    return second
+
+
+def project_document(document, fields):
+    """Projects the fields of a full document in python, the same as get_projection would"""
+    projected = {}
+
+    for field in fields:
+        value = project_value(document, field.split('.'))
+
+        if value is not _MISSING:
+            projected = merge_projections(projected, value)
+
+    return projected
+
+
+def is_projection_proven(result, block, fields):
+    """
+    Whether every top level field of the projected result holding the fields is proven
+    against the data root of its version 3 block, and the block hash against that root
+    """
+    if block is None or block.get('hash_version') != HASH_VERSION_MERKLE \
+            or get_merkle_block_hash(block) != block['hash']:
+        return False
+
+    proofs = result.get('data_proofs', {})
+
+    return all(name in result and name in proofs
+               and verify_inclusion_proof(name, result[name], proofs[name], block['data_root'])
+               for name in get_top_level_fields(fields))
+
+
+def get_proven_projections(query_results, blocks, fields):
+    """Projections of the results proven field by field, keyed by _id, see is_projection_proven"""
+    return {result['_id']: project_document(result, fields) for result in query_results
+            if is_projection_proven(result, blocks.get(result['hash_id']), fields)}
+
+
+def get_proof_candidate_hashes(query_results, verified_results):
+    return [result['hash_id'] for result in query_results
+            if id(result) not in verified_results and 'data_proofs' in result]
+
+
+def get_field_proof(document, block, field):
+    """
+    Proof that the top level field of the document is committed to by its version 3 block,
+    with the block fields needed to check it, or None if the block is not in that format
+    """
+    if block is None or block.get('hash_version') != HASH_VERSION_MERKLE \
+            or field not in document.get('data_proofs', {}):
+        return None
+
+    return {
+        'field': field,
+        'value': document[field],
+        'proof': document['data_proofs'][field],
+        'block': {name: block[name] for name in MERKLE_BLOCK_FIELDS},
+    }
+
+
+def select_projected_results(query_results, verified_results, verified_projections, fields):
+    """
+    Keeps the projected results matching a recently verified document and, for the others,
+    the projection of their full document if that passed its audit
+    """
+    results = []
+
+    for result in query_results:
+        if id(result) in verified_results:
+            results.append(project_document(result, fields))
+        elif result['_id'] in verified_projections:
+            results.append(verified_projections[result['_id']])
+
+    return results
+
+
+def get_as_of_query(query, at):
+    """
+    Returns the query for the versions of a document committed at or before at, a block
+    height or a datetime, and the sort putting the latest of them first
+    """
+    if isinstance(at, datetime):
+        return {**query, 'block_timestamp': {'$lte': at}}, \
+            [('block_timestamp', DESCENDING), ('block_height', DESCENDING)]
+
+    return {**query, 'block_height': {'$lte': at}}, [('block_height', DESCENDING)]
+
+
+def split_history_rows(rows):
+    """
+    Strips the rows for auditing, returning them with the block height and timestamp of each
+    keyed by the identity of its stripped document
+    """
+    metadata = {id(row): (row.get('block_height'), row.get('block_timestamp')) for row in rows}
+    return metadata, [strip_query_result(row) for row in rows]
+
+
+def join_history_entries(metadata, verified_documents):
+    return [(*metadata[id(document)], document) for document in verified_documents]
+
+
+def strip_query_result(result):
+    del result["_id"]
+    result.pop("superceded", None)
+    for field in DATA_BLOCK_METADATA_FIELDS:
+        result.pop(field, None)
+    return result
+
+
+class CreateBlockAlreadyExistsError(Exception):
+    def __init__(self, data_key_field_name, data_key_value):
+        self.message = f'Block of type CREATE cannot be created. \
+                        Key: {data_key_field_name} and Id: {data_key_value} already exists'
+
+
+class BlockHeightConflictError(Exception):
+    def __init__(self, height):
+        self.message = f'A block at height {height} has already been committed'
+
+
+class InvalidPageTokenError(Exception):
+    def __init__(self, page_token):
+        self.message = f'Page token {page_token} is not valid'
+
+
+class CommitConflictError(Exception):
+    def __init__(self, data_collection_name, data_key_value, expected_hash_id, current_hash_id):
+        self.current_hash_id = current_hash_id
+        self.message = f'{data_collection_name} {data_key_value} was expected at hash \
+                        {expected_hash_id} but is at {current_hash_id}'
+
+
+class MongoDb:
+    """
+    Wrapper for mongodb performing the maintenance of the database: indexes, backfills,
+    validation of the chain and audits. Reads and commits are done by AsyncMongoDb.
+    """
+    def __init__(self):
+        self.connection_string, self.database_name = get_connection_settings()
+
+    def watch_blocks(self):
+        """Opens a change stream of blocks inserted into the chain. Requires a replica set"""
+        return self.__get_database().Blocks.watch([{'$match': {'operationType': 'insert'}}])
+
+    def ensure_indexes(self):
+        """Creates the indexes the library relies upon. Existing indexes are left untouched"""
+        self.__get_database().Blocks.create_indexes(BLOCK_INDEXES)
+        mark_collection_indexed('Blocks')
+
+        for data_collection_name, data_key_field_name in list(_registered_collections.items()):
+            self.ensure_collection_indexes(data_collection_name, data_key_field_name)
+
+    def ensure_collection_indexes(self, data_collection_name, data_key_field_name):
+        """
+        Creates the indexes of the data collection and of the DataKeys collection, records the
+        keys of CREATE blocks committed before DataKeys existed and loads the key filter of
+        the collection
+        """
+        logging.info(f'Ensuring indexes for collection: {data_collection_name}')
+        database = self.__get_database()
+        database[data_collection_name].create_indexes(
+            get_data_collection_indexes(data_key_field_name))
+        database.DataKeys.create_indexes(DATA_KEY_INDEXES)
+        self.backfill_data_keys(data_collection_name, data_key_field_name)
+        self.load_key_filter(data_collection_name)
+        mark_collection_indexed(data_collection_name)
+
+    def load_key_filter(self, data_collection_name):
+        """Rebuilds the in process key filter of the collection from the DataKeys collection"""
+        data_keys = self.__get_database().DataKeys
+        key_query = {'collection': data_collection_name}
+
+        key_filters.load(data_collection_name,
+                         (document['key'] for document in data_keys.find(
+                             filter=key_query, projection={'_id': 0, 'key': 1},
+                             batch_size=AUDIT_BATCH_SIZE)),
+                         data_keys.count_documents(key_query))
+
+    def backfill_data_keys(self, data_collection_name, data_key_field_name):
+        """
+        Records in the DataKeys collection the key of every CREATE document of the data
+        collection. Runs once per collection, a checkpoint marks it as done. Returns the number
+        of keys recorded.
+        """
+        database = self.__get_database()
+        checkpoint_id = f'data_keys/{data_collection_name}'
+
+        if database.ValidationCheckpoints.find_one({'_id': checkpoint_id}) is not None:
+            return 0
+
+        backfilled_count = 0
+        batch = []
+
+        for document in database[data_collection_name].find(
+                filter={'block_type': 'CREATE'},
+                projection={'_id': 0, data_key_field_name: 1, 'hash_id': 1},
+                batch_size=AUDIT_BATCH_SIZE):
+            batch.append(UpdateOne(
+                get_data_key_query(data_collection_name, document.get(data_key_field_name)),
+                {'$setOnInsert': {'hash_id': document['hash_id']}}, upsert=True))
+
+            if len(batch) == AUDIT_BATCH_SIZE:
+                backfilled_count += \
+                    database.DataKeys.bulk_write(batch, ordered=False).upserted_count
+                batch = []
+
+        if len(batch) > 0:
+            backfilled_count += database.DataKeys.bulk_write(batch, ordered=False).upserted_count
+
+        database.ValidationCheckpoints.replace_one(
+            {'_id': checkpoint_id},
+            {'backfilled_at': datetime.now(timezone.utc)},
+            upsert=True)
+
+        if backfilled_count > 0:
+            logging.info(f'Backfilled {backfilled_count} keys of collection: '
+                         f'{data_collection_name}')
+
+        return backfilled_count
+
+    def get_index_report(self):
+        """
+        Reports, per collection, the declared indexes that are missing and the existing
+        indexes that have not been used since the server started
+        """
         database = self.__get_database()
-        return database.Blocks.count()
+        declared_indexes = {'Blocks': BLOCK_INDEXES, 'DataKeys': DATA_KEY_INDEXES}
+
+        for data_collection_name, data_key_field_name in _registered_collections.items():
+            declared_indexes[data_collection_name] = \
+                get_data_collection_indexes(data_key_field_name)
+
+        report = {}
+
+        for collection_name, indexes in declared_indexes.items():
+            collection = database[collection_name]
+            existing_names = set(collection.index_information().keys())
+            usage = {stats['name']: stats['accesses']['ops']
+                     for stats in collection.aggregate([{'$indexStats': {}}])}
+
+            report[collection_name] = {
+                'missing': [index.document['name'] for index in indexes
+                            if index.document['name'] not in existing_names],
+                'unused': [name for name, ops in usage.items() if ops == 0 and name != '_id_'],
+            }
+
+        return report
 
     def __get_database(self):
-        client = MongoClient(self.connection_string)
-        return client[self.database_name]
+        return get_client(self.connection_string)[self.database_name]
 
-    def __find_base(self, collection_name, query):
+    def __get_blocks_by_hash(self, hashes):
+        database = self.__get_database()
+        unique_hashes = list(dict.fromkeys(hashes))
+        blocks = {}
+
+        for index in range(0, len(unique_hashes), AUDIT_BATCH_SIZE):
+            batch = unique_hashes[index:index + AUDIT_BATCH_SIZE]
+            for block in database.Blocks.find(filter={"hash": {"$in": batch}},
+                                              projection={'_id': 0}):
+                blocks[block['hash']] = block
+
+        return blocks
+
+    def get_blockchain_hash_links(self, after_height=None):
+        """
+        Streams the hash links of the chain in height order, optionally only those of
+        blocks above the given height
+        """
+        query = {} if after_height is None else {'height': {'$gt': after_height}}
+
+        return self.__get_database().Blocks.find(filter=query, sort=[("height", 1)],
+                            projection={'hash': 1, 'previous_hash': 1, 'height': 1, '_id': 0},
+                            batch_size=HASH_LINK_BATCH_SIZE)
+
+    def get_blocks_by_height(self, start_height, end_height):
+        """Streams the blocks between the two heights, inclusive, in height order"""
+        return self.__get_database().Blocks.find(
+            filter={'height': {'$gte': start_height, '$lte': end_height}},
+            sort=[("height", 1)], projection={'_id': 0})
+
+    def backfill_block_heights(self):
+        """
+        Gives blocks committed before heights were introduced their height by following the
+        hash links forward from the highest block that has one. Runs once, a checkpoint marks
+        it as done. Returns the number of blocks updated.
+        """
         database = self.__get_database()
 
-        query['superceded'] = False
+        if database.ValidationCheckpoints.find_one({'_id': 'block_heights'}) is not None:
+            return 0
 
-        return database[collection_name].find(filter=query, projection={'block_type': 0})
+        head = database.Blocks.find_one({'height': {'$type': 'number'}}, sort=[('height', -1)])
+        last_hash, height = ('', -1) if head is None else (head['hash'], head['height'])
 
-    def find_one(self, collection_name, query):
-        result = self.__find_base(collection_name, query)
-        sorted_result = list(result.sort([("_id", -1)]).limit(1))
+        pending_blocks = {}
+        updates = []
+        updated_count = 0
 
-        if len(sorted_result) == 0:
-            return None
+        for block in database.Blocks.find(filter={'height': {'$exists': False}},
+                                          sort=[("_id", 1)],
+                                          projection={'hash': 1, 'previous_hash': 1},
+                                          batch_size=HASH_LINK_BATCH_SIZE):
+            pending_blocks[block['previous_hash']] = block
 
-        result = sorted_result[0]
-        del result["_id"]
-        del result["superceded"]
+            while last_hash in pending_blocks:
+                next_block = pending_blocks.pop(last_hash)
+                height += 1
+                updates.append(UpdateOne({'_id': next_block['_id']}, {'$set': {'height': height}}))
+                last_hash = next_block['hash']
 
-        return self.audit_result(result)
+            if len(updates) >= HASH_LINK_BATCH_SIZE:
+                database.Blocks.bulk_write(updates, ordered=False)
+                updated_count += len(updates)
+                updates = []
 
-    def find(self, collection_name, query):
-        results = list(self.__find_base(collection_name, query).sort([("_id", -1)]))
-        for result in results:
-            del result["_id"]
-            del result["superceded"]
+        if len(updates) > 0:
+            database.Blocks.bulk_write(updates, ordered=False)
+            updated_count += len(updates)
 
-        return self.audit_results(results)
+        if len(pending_blocks) > 0:
+            logging.error(f'{len(pending_blocks)} blocks could not be linked into the chain '
+                          'and were left without a height')
 
-    def audit_result(self, query_result):
-        database = self.__get_database()
+        database.ValidationCheckpoints.replace_one(
+            {'_id': 'block_heights'},
+            {'unlinked_count': len(pending_blocks), 'backfilled_at': datetime.now(timezone.utc)},
+            upsert=True)
 
-        block = database.Blocks.find_one(filter={"hash": query_result['hash_id']})
+        if updated_count > 0:
+            logging.info(f'Backfilled height for {updated_count} blocks')
 
-        proposed_hash = generate_audit_block(block['id'], query_result, block['block_type'],
-                             block['timestamp'], block['previous_hash'])
+        return updated_count
 
-        if proposed_hash.hash == block['hash']:
-            return query_result
-        return None
+    def get_block_batches(self, batch_size):
+        """Streams every block of the chain in height order as lists of up to batch_size"""
+        batch = []
 
-    def audit_results(self, query_results):
-        database = self.__get_database()
-        results = []
+        for block in self.__get_database().Blocks.find(sort=[("height", 1)],
+                                                       projection={'_id': 0},
+                                                       batch_size=batch_size):
+            batch.append(block)
 
-        for result in query_results:
-            block = database.Blocks.find_one(filter={"hash": result['hash_id']})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
 
-            proposed_hash = generate_audit_block(block['id'], result, block['block_type'],
-                             block['timestamp'], block['previous_hash']).hash
+        if len(batch) > 0:
+            yield batch
 
-            if proposed_hash == block['hash']:
-                results.append(result)
+    def get_data_collection_names(self):
+        database = self.__get_database()
+        return [name for name in database.list_collection_names()
+                if name not in INTERNAL_COLLECTIONS and not name.startswith('system.')]
+
+    def ensure_hash_id_indexes(self, collection_names):
+        """
+        Creates the hash_id index on data collections that may never have had their indexes
+        ensured by this process, so looking documents up by block hash does not scan them
+        """
+        database = self.__get_database()
 
-        return results
+        for collection_name in collection_names:
+            database[collection_name].create_index([('hash_id', ASCENDING)])
 
-    def get_blockchain_hash_links(self):
-        block_hash_links = self.__get_database().Blocks.find(sort=[("_id", -1)],
-                            projection={'hash': 1, 'previous_hash': 1, '_id': 0})
-        return {elem['hash']: elem['previous_hash'] for elem in list(block_hash_links)}
+    def get_documents_by_hash(self, hashes, collection_names=None):
+        """
+        Fetches the data documents stored for the given block hashes from every data
+        collection, or the given ones, stripped back to the fields the block hash was
+        computed over. Each lookup is served by the hash_id index of the collection.
+        """
+        database = self.__get_database()
+        documents = {}
+
+        if collection_names is None:
+            collection_names = self.get_data_collection_names()
+
+        for collection_name in collection_names:
+            for document in database[collection_name].find(
+                    filter={'hash_id': {'$in': hashes}},
+                    projection={'_id': 0, 'superceded': 0, 'block_type': 0,
+                                **{field: 0 for field in DATA_BLOCK_METADATA_FIELDS}}):
+                documents[document['hash_id']] = document
+
+        return documents
+
+    def backfill_data_block_metadata(self):
+        """
+        Copies the height and timestamp of their block onto the data documents of every
+        registered collection committed before they were stored there. Documents whose block
+        cannot be found are given a null height and timestamp so they are not looked at
+        again. Runs once per collection, a checkpoint marks it as done. Returns the number of
+        documents given the height and timestamp of their block.
+        """
+        database = self.__get_database()
+        updated_count = 0
+
+        for data_collection_name in list(_registered_collections):
+            checkpoint_id = f'data_block_metadata/{data_collection_name}'
+
+            if database.ValidationCheckpoints.find_one({'_id': checkpoint_id}) is not None:
+                continue
+
+            collection = database[data_collection_name]
+            unresolved_count = 0
+            batch = []
+
+            for document in collection.find(filter={'block_height': {'$exists': False}},
+                                            projection={'hash_id': 1},
+                                            batch_size=AUDIT_BATCH_SIZE):
+                batch.append(document)
+
+                if len(batch) == AUDIT_BATCH_SIZE:
+                    resolved_count = self.__backfill_data_block_metadata(collection, batch)
+                    updated_count += resolved_count
+                    unresolved_count += len(batch) - resolved_count
+                    batch = []
+
+            if len(batch) > 0:
+                resolved_count = self.__backfill_data_block_metadata(collection, batch)
+                updated_count += resolved_count
+                unresolved_count += len(batch) - resolved_count
+
+            database.ValidationCheckpoints.replace_one(
+                {'_id': checkpoint_id},
+                {'unresolved_count': unresolved_count,
+                 'backfilled_at': datetime.now(timezone.utc)},
+                upsert=True)
+
+            if unresolved_count > 0:
+                logging.error(f'{unresolved_count} documents of collection: '
+                              f'{data_collection_name} have no block and were left without a '
+                              'block height and timestamp')
+
+        if updated_count > 0:
+            logging.info(f'Backfilled block height and timestamp of {updated_count} documents')
+
+        return updated_count
+
+    def __backfill_data_block_metadata(self, collection, documents):
+        """Updates the documents from their blocks, returning how many had one"""
+        blocks = self.__get_blocks_by_hash([document['hash_id'] for document in documents])
+        updates = []
+
+        for document in documents:
+            block = blocks.get(document['hash_id'])
+            updates.append(UpdateOne({'_id': document['_id']}, {'$set': {
+                'block_height': None if block is None else block.get('height'),
+                'block_timestamp': None if block is None else parse_block_timestamp(
+                    block['timestamp'])}}))
+
+        collection.bulk_write(updates, ordered=False)
+
+        return sum(document['hash_id'] in blocks for document in documents)
+
+    def get_validation_checkpoint(self):
+        return self.__get_database().ValidationCheckpoints.find_one({'_id': 'chain'})
+
+    def save_validation_checkpoint(self, height, block_hash):
+        self.__get_database().ValidationCheckpoints.replace_one(
+            {'_id': 'chain'},
+            {'height': height, 'hash': block_hash, 'verified_at': datetime.now(timezone.utc)},
+            upsert=True)
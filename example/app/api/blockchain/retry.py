@@ -0,0 +1,81 @@
+"""Retry policy and metrics for commits rejected under contention"""
+
+import os
+import random
+import threading
+
+
+RETRY_HEAD_CHANGED = 'head_changed'
+RETRY_QUORUM_FAILED = 'quorum_failed'
+
+
+class RetryPolicy:
+    """
+    Decides how many attempts a commit gets and how long to back off between them. The delay
+    grows exponentially from base_delay_seconds up to max_delay_seconds and is fully
+    jittered so writers contending for the head spread out instead of retrying in lock step.
+    Commits await the delay with asyncio.sleep, so a commit backing off holds no thread.
+    """
+    def __init__(self, max_attempts=3, base_delay_seconds=0.1, max_delay_seconds=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+    def should_retry(self, attempt):
+        return attempt < self.max_attempts
+
+    def get_delay(self, attempt):
+        """Returns the seconds to wait after the given failed attempt, counting from 1"""
+        return random.uniform(0, min(self.max_delay_seconds,
+                                     self.base_delay_seconds * 2 ** (attempt - 1)))
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the policy from COMMIT_RETRY_MAX_ATTEMPTS, COMMIT_RETRY_BASE_DELAY_MS and
+        COMMIT_RETRY_MAX_DELAY_MS
+        """
+        return cls(int(os.environ.get('COMMIT_RETRY_MAX_ATTEMPTS', 3)),
+                   float(os.environ.get('COMMIT_RETRY_BASE_DELAY_MS', 100)) / 1000,
+                   float(os.environ.get('COMMIT_RETRY_MAX_DELAY_MS', 2000)) / 1000)
+
+
+class RetryMetrics:
+    """Counts commits, the attempts they took and why commits were retried or given up"""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def record_commit(self, attempts):
+        with self.__lock:
+            self.commits += 1
+            self.attempts += attempts
+
+    def record_retry(self, reason):
+        with self.__lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def record_exhausted(self):
+        with self.__lock:
+            self.exhausted += 1
+
+    def reset(self):
+        with self.__lock:
+            self.commits = 0
+            self.attempts = 0
+            self.exhausted = 0
+            self.retries = {}
+
+    def stats(self):
+        """Returns the counters and the mean number of attempts per successful commit"""
+        with self.__lock:
+            return {
+                'commits': self.commits,
+                'mean_attempts': self.attempts / self.commits if self.commits > 0 else 0,
+                'exhausted': self.exhausted,
+                'retries': dict(self.retries),
+            }
+
+
+commit_retry_policy = RetryPolicy.from_environment()
+retry_metrics = RetryMetrics()
@@ -3,23 +3,24 @@ import uuid
 from typing import Optional
 from fastapi import Depends, APIRouter, status
 from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
 from .provider_models import Provider, ProviderSearchResult
 from .common_models import Appointment, Provinces, ProvidableTreatment, AppointmentStatus, Address
-from .blockchain import BlockchainDb
+from .blockchain import AsyncBlockchainDb, get_async_blockchain, iter_json_array, aiter_json_array
 from .util import verify_auth_header
 from .client_models import Client, LinkedProvider
 
 api = APIRouter(
     prefix="/api/provider",
     tags=["providers"],
-    dependencies=[Depends(BlockchainDb),Depends(verify_auth_header)],
+    dependencies=[Depends(get_async_blockchain),Depends(verify_auth_header)],
     responses={404: {"description": "Not found"}},
 )
 
 @api.get("/{provider_id}", response_model=Provider, status_code=status.HTTP_200_OK)
-def get_provider(provider_id: str, database: BlockchainDb = Depends()):
+async def get_provider(provider_id: str, database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Returns a single provider"""
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result = await database.find_one('Provider', {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -27,18 +28,18 @@ def get_provider(provider_id: str, database: BlockchainDb = Depends()):
     return Provider(**result)
 
 @api.put("/{provider_id}", status_code=status.HTTP_200_OK)
-def update_provider(provider_id: str, provider: Provider, database: BlockchainDb = Depends()):
+async def update_provider(provider_id: str, provider: Provider, database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Updates a provider"""
     if provider.providerId != provider_id:
         raise HTTPException(status_code=400,
                             detail='Provider id in query parameter doesn\'t match payload')
 
-    database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
+    await database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
 
 @api.get("/{provider_id}/providable-treatments", status_code=status.HTTP_200_OK)
-def get_provider_providable_treatments(provider_id: str, database: BlockchainDb = Depends()):
+async def get_provider_providable_treatments(provider_id: str, database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Gets the treatments a provider can provide to a client"""
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result = await database.find_one('Provider', {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -46,10 +47,11 @@ def get_provider_providable_treatments(provider_id: str, database: BlockchainDb
     return Provider(**result).providableTreatments
 
 @api.post("/{provider_id}/providable-treatments", status_code=status.HTTP_200_OK)
-def add_provider_providable_treatment(provider_id: str, providableTreatment: ProvidableTreatment,
-                                        database: BlockchainDb = Depends()):
+async def add_provider_providable_treatment(provider_id: str, providableTreatment: ProvidableTreatment,
+                                              database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Adds a treatments that a provider can provide to a client"""
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result, hash_id = await database.find_one_with_hash_id('Provider',
+                                                          {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -65,15 +67,17 @@ def add_provider_providable_treatment(provider_id: str, providableTreatment: Pro
     providableTreatment.providableTreatmentId = str(uuid.uuid4())
     provider.providableTreatments.append(providableTreatment)
 
-    database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
+    await database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id,
+                                      expected_hash_id=hash_id)
 
 @api.post("/{provider_id}/address", status_code=status.HTTP_200_OK)
-def add_provider_address(provider_id: str, address: Address,
-                                        database: BlockchainDb = Depends()):
+async def add_provider_address(provider_id: str, address: Address,
+                                              database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """
     Adds provider address
     """
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result, hash_id = await database.find_one_with_hash_id('Provider',
+                                                          {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -82,14 +86,16 @@ def add_provider_address(provider_id: str, address: Address,
     address.addressId = str(uuid.uuid4())
     provider.addresses.append(address)
 
-    database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
+    await database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id,
+                                      expected_hash_id=hash_id)
 
 @api.delete("/{provider_id}/providable-treatments/{providable_treatment_id}", status_code=status.HTTP_200_OK)
-def delete_provider_providable_treatment(provider_id: str,
-                                        providable_treatment_id: str,
-                                        database: BlockchainDb = Depends()):
+async def delete_provider_providable_treatment(provider_id: str,
+                                              providable_treatment_id: str,
+                                              database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Adds a treatments that a provider can provide to a client"""
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result, hash_id = await database.find_one_with_hash_id('Provider',
+                                                          {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -104,16 +110,18 @@ def delete_provider_providable_treatment(provider_id: str,
 
     provider.providableTreatments = providable_treatments
 
-    database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
+    await database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id,
+                                      expected_hash_id=hash_id)
 
 @api.delete("/{provider_id}/address/{address_id}", status_code=status.HTTP_200_OK)
-def delete_provider_address(provider_id: str,
-                                        address_id: str,
-                                        database: BlockchainDb = Depends()):
+async def delete_provider_address(provider_id: str,
+                                              address_id: str,
+                                              database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """
     Removes an address from a provider
     """
-    result = database.find_one('Provider', {'providerId': provider_id})
+    result, hash_id = await database.find_one_with_hash_id('Provider',
+                                                          {'providerId': provider_id})
 
     if result is None:
         raise HTTPException(status_code=404, detail='Provider not found')
@@ -128,23 +136,21 @@ def delete_provider_address(provider_id: str,
 
     provider.addresses = addresses
 
-    database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id)
+    await database.commit_transaction(provider, 'EDIT', 'Provider', 'providerId', provider_id,
+                                      expected_hash_id=hash_id)
 
 @api.get("/{provider_id}/appointments", status_code=status.HTTP_200_OK)
-def get_provider_appointments(provider_id: str, database: BlockchainDb = Depends()):
+async def get_provider_appointments(provider_id: str, database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Gets appointments that are assigned to a provider"""
-    result = database.find('Appointment', {'providerId': provider_id})
-
-    if result is None:
-        return {}
-
-    return result
+    return StreamingResponse(
+        aiter_json_array(database.find_iter('Appointment', {'providerId': provider_id})),
+        media_type='application/json')
 
 @api.get("/{provider_id}/appointments/{appointment_id}", status_code=status.HTTP_200_OK)
-def get_provider_appointment(provider_id: str, appointment_id: str,
-                                database: BlockchainDb = Depends()):
+async def get_provider_appointment(provider_id: str, appointment_id: str,
+                                      database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Gets a single appoint that is assigned to a provider"""
-    result = database.find_one('Appointment',
+    result = await database.find_one('Appointment',
                             {'providerId': provider_id, 'appointmentId': appointment_id})
 
     if result is None:
@@ -153,11 +159,11 @@ def get_provider_appointment(provider_id: str, appointment_id: str,
     return result
 
 @api.put("/{provider_id}/appointments/{appointment_id}/accept", status_code=status.HTTP_200_OK)
-def accept_provider_appointment(provider_id: str,
-                                appointment_id: str,
-                                database: BlockchainDb = Depends()):
+async def accept_provider_appointment(provider_id: str,
+                                      appointment_id: str,
+                                      database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Accepts an appointment that is assigned to a provider"""
-    appointment = database.find_one('Appointment',
+    appointment, hash_id = await database.find_one_with_hash_id('Appointment',
                               {'providerId': provider_id, 'appointmentId': appointment_id})
 
     if appointment is None:
@@ -168,17 +174,18 @@ def accept_provider_appointment(provider_id: str,
     updated_appointment.status = AppointmentStatus.Accepted
 
     #need to add protect so that only 1 create block can exist for a given ID
-    result = database.commit_transaction(updated_appointment, 'EDIT',
-                                    'Appointment', 'appointmentId', appointment_id)
+    result = await database.commit_transaction(updated_appointment, 'EDIT',
+                                    'Appointment', 'appointmentId', appointment_id,
+                                    expected_hash_id=hash_id)
 
     return result
 
 @api.put("/{provider_id}/appointments/{appointment_id}/reject", status_code=status.HTTP_200_OK)
-def reject_provider_appointment(provider_id: str,
-                                appointment_id: str,
-                                database: BlockchainDb = Depends()):
+async def reject_provider_appointment(provider_id: str,
+                                      appointment_id: str,
+                                      database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     """Rejects an appointment that is assigned to a provider"""
-    appointment = database.find_one('Appointment',
+    appointment, hash_id = await database.find_one_with_hash_id('Appointment',
                                 {'providerId': provider_id, 'appointmentId': appointment_id})
 
     if appointment is None:
@@ -189,21 +196,22 @@ def reject_provider_appointment(provider_id: str,
     updated_appointment.status = AppointmentStatus.Rejected
 
     #need to add protect so that only 1 create block can exist for a given ID
-    result = database.commit_transaction(updated_appointment, 'EDIT',
-                                    'Appointment', 'appointmentId', appointment_id)
+    result = await database.commit_transaction(updated_appointment, 'EDIT',
+                                    'Appointment', 'appointmentId', appointment_id,
+                                    expected_hash_id=hash_id)
 
     return result
 
 @api.put("/{provider_id}/appointments/{appointment_id}", status_code=status.HTTP_200_OK)
-def update_provider_appointment(provider_id: str,
-                                appointment_id: str,
-                                appointment: Appointment,
-                                database: BlockchainDb = Depends()):
+async def update_provider_appointment(provider_id: str,
+                                      appointment_id: str,
+                                      appointment: Appointment,
+                                      database: AsyncBlockchainDb = Depends(get_async_blockchain)):
     if appointment.providerId != provider_id or appointment.appointmentId != appointment_id:
         raise HTTPException(status_code=400,
                             detail='Provider id in query parameter doesn\'t match payload')
 
-    existing_appointment = Appointment(**database.find_one('Appointment',
+    existing_appointment = Appointment(**await database.find_one('Appointment',
                             {'providerId': provider_id, 'appointmentId': appointment_id}))
 
     if existing_appointment.status == AppointmentStatus.Completed \
@@ -212,10 +220,10 @@ def update_provider_appointment(provider_id: str,
                             detail='Cannot update a completed or rejected appointment')
 
     #need to add protect so that only 1 create block can exist for a given ID
-    result = database.commit_transaction(appointment, 'EDIT',
+    result = await database.commit_transaction(appointment, 'EDIT',
                                     'Appointment', 'appointmentId', appointment_id)
 
-    related_client_result = database.find_one('Client', { 'clientId': appointment.clientId})
+    related_client_result = await database.find_one('Client', { 'clientId': appointment.clientId})
 
     if related_client_result is None:
         raise HTTPException(status_code=404, detail='Client related to appointment not found')
@@ -232,9 +240,14 @@ def update_provider_appointment(provider_id: str,
     return result
 
 @api.get("/search/available", status_code=status.HTTP_200_OK)
-def search_provider(name: Optional[str]=None, city: Optional[str]=None,
-                    province: Optional[Provinces]=None, database: BlockchainDb = Depends()):
-    """Searches for a provider based on nothing, a name, a city or a province"""
+async def search_provider(name: Optional[str]=None, city: Optional[str]=None,
+                          province: Optional[Provinces]=None, limit: int=100,
+                          page_token: Optional[str]=None,
+                          database: AsyncBlockchainDb = Depends(get_async_blockchain)):
+    """
+    Searches for a provider based on nothing, a name, a city or a province. Returns up to
+    limit providers, the token for the next page is in the X-Next-Page-Token header.
+    """
     query = {}
 
     if name is not None:
@@ -249,11 +262,11 @@ def search_provider(name: Optional[str]=None, city: Optional[str]=None,
         province_query = { "address.province": province }
         query = {**query, **province_query}
 
-    raw_results = database.find('Provider', query)
-
-    results = []
+    raw_results, next_page_token = await database.find_page('Provider', query, limit, page_token,
+                                                            list(ProviderSearchResult.__fields__))
 
-    for raw_result in raw_results:
-        results.append(ProviderSearchResult(**raw_result))
+    results = (ProviderSearchResult(**raw_result) for raw_result in raw_results)
+    headers = {} if next_page_token is None else {'X-Next-Page-Token': next_page_token}
 
-    return results
+    return StreamingResponse(iter_json_array(results), media_type='application/json',
+                             headers=headers)
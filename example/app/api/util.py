@@ -1,17 +1,9 @@
 """Utility functions"""
 
-import json
-import uuid
 import os
-from datetime import datetime
 from pycognito import Cognito
 from fastapi import Depends, HTTPException
 from fastapi.security.http import HTTPBearer, HTTPBasicCredentials
-from .common_models import AppointmentStatus, Provinces, Appointment, \
-                            Address, Name, PhoneNumbers, ProvidableTreatment, \
-                             PrescribedTreatment, Notes
-from .provider_models import Provider
-from .client_models import Client, LinkedProvider
 
 auth = HTTPBearer()
 
@@ -30,35 +22,3 @@ async def verify_auth_header(authorization: HTTPBasicCredentials = Depends(auth)
     except Exception as forbidden:
         raise HTTPException(status_code=403) from forbidden
 
-
-class HelperEncoder(json.JSONEncoder):
-    """
-    Helper for JSON decoding of classes
-    """
-    def default(self, o):
-        if isinstance(o, uuid.UUID):
-            return str(o)
-
-        if isinstance(o, datetime):
-            return o.isoformat()
-
-        if isinstance(o, Provinces):
-            return o.value
-
-        if isinstance(o, AppointmentStatus):
-            return o.value
-
-        if isinstance(o,
-                     (Address,
-                        Appointment,
-                        Client,
-                        Name,
-                        PhoneNumbers,
-                        ProvidableTreatment,
-                        Provider,
-                        LinkedProvider, 
-                        PrescribedTreatment, 
-                        Notes)):
-            return o.__dict__
-
-        return json.JSONEncoder.default(self, o)
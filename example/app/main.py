@@ -5,7 +5,13 @@ import logging
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, status, Request
-from .api import auth_api, client_api, provider_api, blockchain_api
+from fastapi.responses import JSONResponse
+from .api import auth_api, client_api, provider_api, blockchain_api, admin_api
+from .api.blockchain import open_connection_pool, close_connection_pool, \
+    start_chain_head_watcher, stop_chain_head_watcher, close_peer_sessions, ensure_indexes, \
+    register_collection, close_async_connection_pool, get_blockchain, close_blockchain, \
+    get_async_blockchain, close_async_blockchain, start_membership_refresh, stop_membership_refresh, \
+    CommitConflictError, InvalidPageTokenError
 import uuid
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
@@ -32,10 +38,47 @@ async def add_correlation_header(request: Request, call_next):
     response.headers["X-Correlation-Id"] = correlation_id
     return response
 
+@app.exception_handler(CommitConflictError)
+async def commit_conflict_handler(request: Request, error: CommitConflictError):
+    """Reports a document changed by another request since it was read as a conflict"""
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={'detail': error.message})
+
+@app.exception_handler(InvalidPageTokenError)
+async def invalid_page_token_handler(request: Request, error: InvalidPageTokenError):
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={'detail': error.message})
+
+@app.on_event("startup")
+def startup():
+    """
+    Prepares the database connection pool, indexes, shared blockchain, node membership and
+    chain head for this worker
+    """
+    open_connection_pool()
+    register_collection('Provider', 'providerId')
+    register_collection('Client', 'clientId')
+    register_collection('Appointment', 'appointmentId')
+    ensure_indexes()
+    get_blockchain()
+    get_async_blockchain()
+    start_membership_refresh()
+    start_chain_head_watcher()
+
+@app.on_event("shutdown")
+def shutdown():
+    """Releases the connections held by this worker"""
+    stop_chain_head_watcher()
+    stop_membership_refresh()
+    close_async_blockchain()
+    close_blockchain()
+    close_peer_sessions()
+    close_connection_pool()
+    close_async_connection_pool()
+
 app.include_router(auth_api)
 app.include_router(client_api)
 app.include_router(provider_api)
 app.include_router(blockchain_api)
+app.include_router(admin_api)
 
 @app.get('/api/health', status_code=status.HTTP_200_OK)
 def health():
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of block hashing throughput for each hash format version.
+Run from the example directory with: python -m test.load_testing.hash_benchmark
+"""
+import timeit
+import uuid
+
+from app.api.blockchain.models import Block, HASH_VERSION_LEGACY, HASH_VERSION_CANONICAL
+
+
+def build_provider_payload(treatment_count):
+    return {
+        'providerId': str(uuid.uuid4()),
+        'name': {'firstName': 'W', 'middleName': 'A', 'lastName': 'H'},
+        'phoneNumbers': {'home': '1234567890', 'mobile': '1234567890', 'work': '1234567890'},
+        'addresses': [{'addressId': str(uuid.uuid4()), 'unit': '1',
+                       'streetAddress': '123 fake street', 'city': 'Fake City', 'province': 0,
+                       'country': 'Canada', 'postalCode': 'l1l1l1'}],
+        'providableTreatments': [{'providableTreatmentId': str(uuid.uuid4()),
+                                  'name': f'Treatment {index}',
+                                  'description': 'A "quoted" description\n' * 4}
+                                 for index in range(treatment_count)],
+        'email': 'a@a.com',
+    }
+
+
+def hash_block(payload, hash_version):
+    return Block(uuid.uuid4().hex, payload, 'EDIT', '2021-01-29 23:50:58 +0000',
+                 'f' * 64, 'Provider', 'providerId', payload['providerId'],
+                 hash_version=hash_version).hash
+
+
+def main():
+    for treatment_count in (1, 50, 500):
+        payload = build_provider_payload(treatment_count)
+        number = max(100, 20000 // treatment_count)
+        results = {}
+
+        for hash_version in (HASH_VERSION_LEGACY, HASH_VERSION_CANONICAL):
+            duration = min(timeit.repeat(lambda: hash_block(payload, hash_version),
+                                         number=number, repeat=5))
+            results[hash_version] = number / duration
+
+        print(f'{treatment_count} treatments: '
+              f'v{HASH_VERSION_LEGACY} {results[HASH_VERSION_LEGACY]:.0f} blocks/s, '
+              f'v{HASH_VERSION_CANONICAL} {results[HASH_VERSION_CANONICAL]:.0f} blocks/s, '
+              f'{results[HASH_VERSION_CANONICAL] / results[HASH_VERSION_LEGACY]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
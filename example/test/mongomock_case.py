@@ -0,0 +1,55 @@
+"""Test case running the blockchain against an in memory database"""
+
+import os
+import unittest
+from unittest import mock
+import mongomock
+import mongomock_motor
+from blockchain import mongo, async_mongo, membership, audit_cache, chain_head, key_filters, \
+    close_connection_pool, close_async_connection_pool, close_blockchain, \
+    close_async_blockchain, close_peer_sessions
+
+CONNECTION_STRING = 'mongodb://localhost'
+DATABASE = 'test'
+
+
+def get_mock_async_client(connection_string):
+    return mongomock_motor.AsyncMongoMockClient(
+        mock_mongo_client=mongo.get_client(connection_string))
+
+
+def reset_blockchain():
+    close_blockchain()
+    close_async_blockchain()
+    close_connection_pool()
+    close_async_connection_pool()
+    close_peer_sessions()
+    mongo._indexed_collections.clear()
+    audit_cache.clear()
+    chain_head.invalidate()
+    key_filters.clear()
+
+
+class MongomockTestCase(unittest.TestCase):
+    """
+    Runs each test against a fresh mongomock database, read and written by the sync and the
+    async storage alike, with no other nodes to confer with. mongomock has no sessions so
+    commits take the path without a transaction.
+    """
+    def setUp(self):
+        patches = [
+            mock.patch.dict(os.environ, {'CONNECTION_STRING': CONNECTION_STRING,
+                                         'DATABASE': DATABASE}),
+            mock.patch.object(mongo, 'MongoClient', mongomock.MongoClient),
+            mock.patch.object(mongo, '_transactions_supported', False),
+            mock.patch.object(async_mongo, 'get_async_client', get_mock_async_client),
+            mock.patch.object(membership, 'get_snapshot', return_value=((), ())),
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        reset_blockchain()
+        self.addCleanup(reset_blockchain)
+        self.database = mongo.get_client(CONNECTION_STRING)[DATABASE]
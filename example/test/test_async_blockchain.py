@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from unittest import mock
+from blockchain import get_blockchain, get_async_blockchain, CreateBlockAlreadyExistsError
+from blockchain import async_mongo
+from test.mongomock_case import MongomockTestCase
+
+
+class TestAsyncBlockchain(MongomockTestCase):
+    def test_creates_the_genesis_block_once(self):
+        get_blockchain()
+        asyncio.run(get_async_blockchain().ensure_genesis_block())
+
+        self.assertEqual(self.database.Blocks.count_documents({}), 1)
+        self.assertEqual(self.database.Blocks.find_one()['previous_hash'], '')
+
+    def test_commit_chains_onto_the_head(self):
+        blockchain = get_async_blockchain()
+
+        async def commit():
+            await blockchain.commit_transaction({'providerId': 'p1', 'n': 1}, 'CREATE',
+                                                'Provider', 'providerId', 'p1')
+            await blockchain.commit_transaction({'providerId': 'p1', 'n': 2}, 'EDIT',
+                                                'Provider', 'providerId', 'p1')
+            return await blockchain.find_one('Provider', {'providerId': 'p1'})
+
+        self.assertEqual(asyncio.run(commit()), {'providerId': 'p1', 'n': 2})
+        self.assertEqual([block['height'] for block in self.database.Blocks.find()], [0, 1, 2])
+        self.assertTrue(get_blockchain().validate(full=True))
+
+    def test_commits_run_on_the_shared_loop(self):
+        commit_threads = set()
+        commit_block = async_mongo.AsyncMongoDb.commit_block
+
+        async def record_thread(database, block, expected_hash_id=None):
+            commit_threads.add(threading.current_thread().name)
+            return await commit_block(database, block, expected_hash_id)
+
+        async def commit():
+            await asyncio.gather(*[get_async_blockchain().commit_transaction(
+                {'providerId': f'p{index}'}, 'CREATE', 'Provider', 'providerId', f'p{index}')
+                for index in range(5)])
+
+        with mock.patch.object(async_mongo.AsyncMongoDb, 'commit_block', record_thread):
+            asyncio.run(commit())
+
+        self.assertEqual(commit_threads, {'peer-sessions'})
+        self.assertEqual(self.database.Blocks.count_documents({}), 6)
+        self.assertTrue(get_blockchain().validate(full=True))
+
+    def test_duplicate_create_is_refused(self):
+        blockchain = get_async_blockchain()
+
+        async def commit():
+            await blockchain.commit_transaction({'providerId': 'p1'}, 'CREATE', 'Provider',
+                                                'providerId', 'p1')
+            await blockchain.commit_transaction({'providerId': 'p1'}, 'CREATE', 'Provider',
+                                                'providerId', 'p1')
+
+        with self.assertRaises(CreateBlockAlreadyExistsError):
+            asyncio.run(commit())
+
+
+class TestBlockchain(MongomockTestCase):
+    def test_sync_api_wraps_the_async_one(self):
+        blockchain = get_blockchain()
+
+        for index in range(3):
+            self.assertTrue(blockchain.commit_transaction(
+                {'providerId': f'p{index}', 'n': index}, 'CREATE', 'Provider', 'providerId',
+                f'p{index}'))
+
+        self.assertEqual(blockchain.head[1], 3)
+        self.assertEqual(blockchain.find_one('Provider', {'providerId': 'p1'}),
+                         {'providerId': 'p1', 'n': 1})
+        self.assertEqual([document['n'] for document in blockchain.find_iter('Provider', {})],
+                         [2, 1, 0])
+
+    def test_commit_transactions_commits_a_run(self):
+        results = get_blockchain().commit_transactions(
+            [({'providerId': f'p{index}'}, 'CREATE', 'Provider', 'providerId', f'p{index}')
+             for index in range(3)])
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(self.database.Blocks.count_documents({}), 4)
+
+    def test_history_iterates_every_version(self):
+        blockchain = get_blockchain()
+        blockchain.commit_transaction({'providerId': 'p1', 'n': 1}, 'CREATE', 'Provider',
+                                      'providerId', 'p1')
+        blockchain.commit_transaction({'providerId': 'p1', 'n': 2}, 'EDIT', 'Provider',
+                                      'providerId', 'p1')
+
+        self.assertEqual([(height, document['n']) for height, _, document
+                          in blockchain.find_history('Provider', 'providerId', 'p1')],
+                         [(1, 1), (2, 2)])
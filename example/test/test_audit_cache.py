@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+from blockchain import get_blockchain, audit_cache
+from blockchain import mongo
+from blockchain.models import HASH_VERSION_MERKLE
+from blockchain.cache import AuditCache
+from test.mongomock_case import MongomockTestCase
+
+
+class TestAuditCache(unittest.TestCase):
+    def test_returns_the_verified_document(self):
+        cache = AuditCache()
+        cache.set('hash', {'providerId': 'p1'})
+
+        self.assertEqual(cache.get('hash'), {'providerId': 'p1'})
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_evicts_the_least_recently_used(self):
+        cache = AuditCache(max_size=2)
+        cache.set('a', {})
+        cache.set('b', {})
+        cache.get('a')
+        cache.set('c', {})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+
+    def test_expires_after_the_ttl(self):
+        cache = AuditCache(ttl_seconds=0)
+        cache.set('hash', {})
+
+        self.assertIsNone(cache.get('hash'))
+
+
+class TestCachedAudit(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_blockchain()
+        self.blockchain.commit_transaction(
+            {'providerId': 'p1', 'name': {'firstName': 'A'}, 'notes': 'n'}, 'CREATE',
+            'Provider', 'providerId', 'p1')
+
+    def read(self, fields=None):
+        return self.blockchain.find_one('Provider', {'providerId': 'p1'}, fields)
+
+    def tamper(self):
+        self.database.Provider.update_one({'providerId': 'p1'},
+                                          {'$set': {'name': {'firstName': 'B'}}})
+
+    def test_unchanged_row_is_served_from_the_cache(self):
+        self.assertIsNotNone(self.read())
+        hits = audit_cache.stats()['hits']
+
+        self.assertEqual(self.read(), {'providerId': 'p1', 'name': {'firstName': 'A'},
+                                       'notes': 'n'})
+        self.assertEqual(audit_cache.stats()['hits'], hits + 1)
+
+    def test_tampered_row_is_rejected_on_a_cache_hit(self):
+        self.assertIsNotNone(self.read())
+        self.tamper()
+
+        self.assertIsNone(self.read())
+
+    def test_projection_of_a_tampered_row_is_rejected_on_a_cache_hit(self):
+        self.assertEqual(self.read(['notes']), {'notes': 'n'})
+        self.tamper()
+
+        self.assertIsNone(self.read(['notes']))
+
+    def test_tampered_projected_field_is_rejected_on_a_cache_hit(self):
+        self.assertIsNotNone(self.read())
+        self.tamper()
+
+        with mock.patch.object(mongo, 'CURRENT_HASH_VERSION', HASH_VERSION_MERKLE):
+            self.assertEqual(self.read(['notes']), {'notes': 'n'})
+            self.assertIsNone(self.read(['name.firstName']))
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timezone
+from blockchain import get_async_blockchain, get_blockchain
+from blockchain.models import parse_block_timestamp
+from blockchain.mongo import MongoDb, register_collection
+from test.mongomock_case import MongomockTestCase
+
+
+class TestBackfillBlockHeights(MongomockTestCase):
+    def insert_legacy_blocks(self, previous_hash, count):
+        for index in range(count):
+            block_hash = f'{previous_hash}/{index}'
+            self.database.Blocks.insert_one({'hash': block_hash, 'previous_hash': previous_hash,
+                                             'timestamp': '2020-01-01 00:00:00.000000'})
+            previous_hash = block_hash
+
+        return previous_hash
+
+    def get_heights(self):
+        return [block.get('height') for block in self.database.Blocks.find(sort=[('_id', 1)])]
+
+    def test_heights_follow_the_hash_links(self):
+        self.insert_legacy_blocks('', 3)
+
+        self.assertEqual(MongoDb().backfill_block_heights(), 3)
+        self.assertEqual(self.get_heights(), [0, 1, 2])
+
+    def test_runs_once(self):
+        last_hash = self.insert_legacy_blocks('', 2)
+        MongoDb().backfill_block_heights()
+        self.insert_legacy_blocks(last_hash, 1)
+
+        self.assertEqual(MongoDb().backfill_block_heights(), 0)
+        self.assertEqual(self.get_heights(), [0, 1, None])
+
+    def test_runs_once_when_blocks_cannot_be_linked(self):
+        self.insert_legacy_blocks('missing', 2)
+
+        self.assertEqual(MongoDb().backfill_block_heights(), 0)
+        self.assertEqual(self.database.ValidationCheckpoints.find_one(
+            {'_id': 'block_heights'})['unlinked_count'], 2)
+
+    def test_head_of_a_legacy_chain_is_given_its_height(self):
+        last_hash = self.insert_legacy_blocks('', 3)
+
+        self.assertEqual(asyncio.run(get_async_blockchain().get_head()), (last_hash, 2))
+
+
+class TestBackfillDataBlockMetadata(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_blockchain()
+
+        for version in range(1, 4):
+            self.blockchain.commit_transaction({'providerId': 'p1', 'version': version},
+                                               'CREATE' if version == 1 else 'EDIT',
+                                               'Provider', 'providerId', 'p1')
+
+        register_collection('Provider', 'providerId')
+
+    def remove_metadata(self):
+        self.database.Provider.update_many(
+            {}, {'$unset': {'block_height': '', 'block_timestamp': ''}})
+
+    def get_heights(self):
+        return [document['block_height']
+                for document in self.database.Provider.find(sort=[('_id', 1)])]
+
+    def test_documents_are_given_the_height_of_their_block(self):
+        heights = self.get_heights()
+        self.remove_metadata()
+
+        self.assertEqual(MongoDb().backfill_data_block_metadata(), 3)
+        self.assertEqual(self.get_heights(), heights)
+
+    def test_documents_without_a_block_are_marked_and_not_read_again(self):
+        self.database.Provider.insert_one({'providerId': 'p2', 'hash_id': 'missing'})
+
+        self.assertEqual(MongoDb().backfill_data_block_metadata(), 0)
+        self.assertIsNone(self.database.Provider.find_one({'providerId': 'p2'})['block_height'])
+        self.assertEqual(self.database.ValidationCheckpoints.find_one(
+            {'_id': 'data_block_metadata/Provider'})['unresolved_count'], 1)
+
+    def test_runs_once_per_collection(self):
+        MongoDb().backfill_data_block_metadata()
+        self.remove_metadata()
+
+        self.assertEqual(MongoDb().backfill_data_block_metadata(), 0)
+        self.assertEqual(self.database.Provider.count_documents(
+            {'block_height': {'$exists': True}}), 0)
+
+
+class TestAsOfAndHistory(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_blockchain()
+
+        for version in range(1, 4):
+            self.blockchain.commit_transaction({'providerId': 'p1', 'version': version},
+                                               'CREATE' if version == 1 else 'EDIT',
+                                               'Provider', 'providerId', 'p1')
+
+        self.blocks = list(self.database.Blocks.find(sort=[('height', 1)]))
+
+    def test_as_of_a_height(self):
+        self.assertIsNone(self.blockchain.find_one_as_of('Provider', {'providerId': 'p1'}, 0))
+        self.assertEqual(self.blockchain.find_one_as_of('Provider', {'providerId': 'p1'}, 2),
+                         {'providerId': 'p1', 'version': 2})
+        self.assertEqual(self.blockchain.find_one_as_of('Provider', {'providerId': 'p1'}, 10),
+                         {'providerId': 'p1', 'version': 3})
+
+    def test_as_of_a_timestamp(self):
+        # Block timestamps have a resolution of a second, so the versions are spread a day
+        # apart, the timestamps are not part of what is audited
+        for version in range(1, 4):
+            self.database.Provider.update_one(
+                {'version': version},
+                {'$set': {'block_timestamp': datetime(2024, 1, version, tzinfo=timezone.utc)}})
+
+        self.assertIsNone(self.blockchain.find_one_as_of(
+            'Provider', {'providerId': 'p1'}, datetime(2023, 12, 31, tzinfo=timezone.utc)))
+        self.assertEqual(self.blockchain.find_one_as_of(
+            'Provider', {'providerId': 'p1'}, datetime(2024, 1, 2, 12, tzinfo=timezone.utc)),
+            {'providerId': 'p1', 'version': 2})
+
+    def test_as_of_leaves_out_a_tampered_version(self):
+        self.database.Provider.update_one({'version': 2}, {'$set': {'name': 'tampered'}})
+
+        self.assertIsNone(self.blockchain.find_one_as_of('Provider', {'providerId': 'p1'}, 2))
+
+    def test_history_is_oldest_first_with_the_block_of_each_version(self):
+        history = list(self.blockchain.find_history('Provider', 'providerId', 'p1'))
+
+        self.assertEqual([(height, document['version']) for height, _, document in history],
+                         [(1, 1), (2, 2), (3, 3)])
+        self.assertEqual([timestamp.replace(tzinfo=timezone.utc)
+                          for _, timestamp, _ in history],
+                         [parse_block_timestamp(block['timestamp'])
+                          for block in self.blocks[1:]])
@@ -0,0 +1,54 @@
+import os
+import unittest
+from unittest import mock
+from blockchain.bloom import BloomFilter, KeyFilters
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_added_keys_are_always_present(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        keys = [f'key{index}' for index in range(1000)]
+
+        for key in keys:
+            bloom_filter.add(key)
+
+        self.assertTrue(all(key in bloom_filter for key in keys))
+
+    def test_false_positive_rate_at_capacity(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+
+        for index in range(1000):
+            bloom_filter.add(f'key{index}')
+
+        false_positives = sum(f'other{index}' in bloom_filter for index in range(10000))
+
+        self.assertLess(false_positives / 10000, 0.03)
+
+
+class TestKeyFilters(unittest.TestCase):
+    def test_unloaded_collection_might_contain_any_key(self):
+        self.assertTrue(KeyFilters().might_contain('Provider', 'p'))
+
+    def test_loaded_collection(self):
+        key_filters = KeyFilters(capacity=100)
+        key_filters.load('Provider', ['a', 'b'])
+        key_filters.add('Provider', 'c')
+
+        self.assertTrue(all(key_filters.might_contain('Provider', key) for key in 'abc'))
+        self.assertFalse(key_filters.might_contain('Provider', 'not created'))
+        self.assertTrue(key_filters.might_contain('Client', 'not created'))
+
+    def test_keys_are_compared_as_strings(self):
+        key_filters = KeyFilters(capacity=100)
+        key_filters.load('Provider', [])
+        key_filters.add('Provider', 42)
+
+        self.assertTrue(key_filters.might_contain('Provider', '42'))
+
+    def test_disabled_filters_are_never_loaded(self):
+        with mock.patch.dict(os.environ, {'KEY_FILTER_ENABLED': 'false'}):
+            key_filters = KeyFilters.from_environment()
+
+        key_filters.load('Provider', ['a'])
+
+        self.assertTrue(key_filters.might_contain('Provider', 'not created'))
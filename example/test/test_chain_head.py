@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+from blockchain import get_blockchain, chain_head
+from blockchain.cache import ChainHeadCache
+from test.mongomock_case import MongomockTestCase
+
+
+class TestChainHeadCache(unittest.TestCase):
+    def get_head(self, cache):
+        async def load_head():
+            return 'loaded', 2
+
+        return asyncio.run(cache.get_async(load_head))
+
+    def test_serves_the_head_until_it_expires(self):
+        cache = ChainHeadCache(ttl_seconds=60)
+        cache.set(('hash', 1))
+
+        self.assertEqual(self.get_head(cache), ('hash', 1))
+
+    def test_expired_head_is_loaded(self):
+        cache = ChainHeadCache(ttl_seconds=0)
+        cache.set(('hash', 1))
+
+        self.assertEqual(self.get_head(cache), ('loaded', 2))
+
+    def test_invalidated_head_is_loaded(self):
+        cache = ChainHeadCache(ttl_seconds=60)
+        cache.set(('hash', 1))
+        cache.invalidate()
+
+        self.assertEqual(self.get_head(cache), ('loaded', 2))
+
+
+class TestStaleHead(MongomockTestCase):
+    def commit(self, key):
+        return get_blockchain().commit_transaction({'providerId': key}, 'CREATE', 'Provider',
+                                                   'providerId', key)
+
+    def test_block_on_a_stale_head_is_refused_without_ensure_indexes(self):
+        self.commit('p1')
+        stale_head = get_blockchain().head
+        self.commit('p2')
+        chain_head.set(stale_head)
+
+        self.assertTrue(self.commit('p3'))
+        self.assertEqual([block['height'] for block in self.database.Blocks.find()],
+                         [0, 1, 2, 3])
+        self.assertTrue(get_blockchain().validate(full=True))
@@ -0,0 +1,61 @@
+import unittest
+from blockchain.blockchain import MAX_PENDING_LINKS, verify_hash_links
+
+
+def create_links(count, start_height=1, first_previous_hash='genesis'):
+    links = []
+    previous_hash = first_previous_hash
+
+    for height in range(start_height, start_height + count):
+        links.append({'height': height, 'hash': f'hash{height}', 'previous_hash': previous_hash})
+        previous_hash = f'hash{height}'
+
+    return links
+
+
+class TestVerifyHashLinks(unittest.TestCase):
+    def test_unbroken_chain(self):
+        self.assertEqual(verify_hash_links(create_links(5), 'genesis'), (True, 5, 'hash5'))
+
+    def test_no_links(self):
+        self.assertEqual(verify_hash_links([], 'genesis'), (True, None, 'genesis'))
+
+    def test_continues_from_a_checkpoint(self):
+        self.assertEqual(verify_hash_links(create_links(3, 11, 'hash10'), 'hash10'),
+                         (True, 13, 'hash13'))
+
+    def test_gap(self):
+        links = create_links(5)
+        del links[2]
+
+        is_valid, _, last_hash = verify_hash_links(links, 'genesis')
+
+        self.assertFalse(is_valid)
+        self.assertEqual(last_hash, 'hash2')
+
+    def test_fork(self):
+        links = create_links(3)
+        links.append({'height': 4, 'hash': 'fork', 'previous_hash': 'hash2'})
+
+        self.assertFalse(verify_hash_links(links, 'genesis')[0])
+
+    def test_two_blocks_on_the_same_predecessor(self):
+        links = create_links(3)
+        links.insert(2, {'height': 3, 'hash': 'other3', 'previous_hash': 'hash2'})
+
+        self.assertFalse(verify_hash_links(links, 'genesis')[0])
+
+    def test_reordered_links(self):
+        links = create_links(6)
+        links[1], links[3] = links[3], links[1]
+
+        self.assertEqual(verify_hash_links(links, 'genesis')[::2], (True, 'hash6'))
+
+    def test_wrong_starting_hash(self):
+        self.assertFalse(verify_hash_links(create_links(3), 'other')[0])
+
+    def test_too_many_pending_links(self):
+        links = create_links(MAX_PENDING_LINKS + 2)
+        links.append(links.pop(0))
+
+        self.assertFalse(verify_hash_links(links, 'genesis')[0])
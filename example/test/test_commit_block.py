@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest import mock
+import mongomock_motor
+from pymongo.errors import OperationFailure
+from blockchain import mongo, get_async_blockchain
+from blockchain.async_mongo import AsyncMongoDb
+from blockchain.models import generate_block
+from blockchain.mongo import BlockHeightConflictError, CreateBlockAlreadyExistsError, \
+    ILLEGAL_OPERATION_ERROR_CODE
+from test.mongomock_case import MongomockTestCase
+
+
+class MockSession:
+    """
+    Session running the transaction callback straight away. mongomock refuses any session
+    that is truthy, so this one is not, while the commit still sees a session.
+    """
+    def __init__(self):
+        self.transaction_count = 0
+
+    def __bool__(self):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def with_transaction(self, callback):
+        self.transaction_count += 1
+        return await callback(self)
+
+
+class TestCommitBlock(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_async_blockchain()
+        asyncio.run(self.blockchain.ensure_genesis_block())
+        self.genesis_hash = self.database.Blocks.find_one({'height': 0})['hash']
+
+    def create_block(self, data_key_value, previous_hash=None, height=1):
+        return generate_block({'providerId': data_key_value}, 'CREATE',
+                              datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S %z'),
+                              previous_hash or self.genesis_hash, 'Provider', 'providerId',
+                              data_key_value, height)
+
+    def commit_block(self, block):
+        return asyncio.run(AsyncMongoDb().commit_block(block))
+
+    def start_session(self, session):
+        async def start_session(client):
+            if isinstance(session, Exception):
+                raise session
+            return session
+
+        patches = [mock.patch.object(mongo, '_transactions_supported', True),
+                   mock.patch.object(mongomock_motor.AsyncMongoMockClient, 'start_session',
+                                     start_session, create=True)]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_data_keys(self):
+        return sorted(document['key'] for document in self.database.DataKeys.find())
+
+    def test_writes_the_block_and_its_data(self):
+        block = self.create_block('p1')
+
+        timings = self.commit_block(block)
+
+        self.assertEqual(self.database.Blocks.find_one({'height': 1})['hash'], block.hash)
+        self.assertEqual(self.database.Provider.find_one({'providerId': 'p1'})['hash_id'],
+                         block.hash)
+        self.assertEqual(self.get_data_keys(), ['p1'])
+        self.assertIn('block_insert', timings)
+
+    def test_writes_in_a_transaction_when_supported(self):
+        session = MockSession()
+        self.start_session(session)
+
+        self.commit_block(self.create_block('p1'))
+
+        self.assertEqual(session.transaction_count, 1)
+        self.assertTrue(mongo.are_transactions_supported())
+        self.assertEqual(self.database.Provider.count_documents({}), 1)
+
+    def test_falls_back_without_transactions_when_illegal(self):
+        self.start_session(OperationFailure('illegal', code=ILLEGAL_OPERATION_ERROR_CODE))
+
+        self.commit_block(self.create_block('p1'))
+
+        self.assertFalse(mongo.are_transactions_supported())
+        self.assertEqual(self.database.Provider.count_documents({}), 1)
+
+    def test_other_failures_do_not_fall_back(self):
+        self.start_session(OperationFailure('other', code=1))
+
+        with self.assertRaises(OperationFailure):
+            self.commit_block(self.create_block('p1'))
+
+        self.assertTrue(mongo.are_transactions_supported())
+        self.assertEqual(self.database.Blocks.count_documents({}), 1)
+
+    def test_data_key_is_released_when_the_height_is_taken(self):
+        self.commit_block(self.create_block('p1'))
+
+        with self.assertRaises(BlockHeightConflictError):
+            self.commit_block(self.create_block('p2'))
+
+        self.assertEqual(self.get_data_keys(), ['p1'])
+        self.assertEqual(self.database.Provider.count_documents({'providerId': 'p2'}), 0)
+
+    def test_duplicate_create_is_refused(self):
+        block = self.create_block('p1')
+        self.commit_block(block)
+
+        with self.assertRaises(CreateBlockAlreadyExistsError):
+            self.commit_block(self.create_block('p1', block.hash, 2))
+
+        self.assertEqual(self.database.Blocks.count_documents({}), 2)
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+from unittest import mock
+from blockchain import get_async_blockchain, CommitConflictError
+from blockchain.async_mongo import AsyncMongoDb
+from blockchain.locks import KeyLockTable
+from app.main import app
+from app.api.blockchain import CommitConflictError as AppCommitConflictError
+from test.mongomock_case import MongomockTestCase
+
+
+class TestKeyLockTable(unittest.TestCase):
+    def test_commits_to_the_same_key_run_one_at_a_time(self):
+        lock_table = KeyLockTable()
+        events = []
+
+        async def commit(key, name):
+            async with lock_table.hold_async(key):
+                events.append(f'{name} start')
+                await asyncio.sleep(0.01)
+                events.append(f'{name} end')
+
+        async def run():
+            await asyncio.gather(commit('p1', 'a'), commit('p1', 'b'), commit('p2', 'c'))
+
+        asyncio.run(run())
+
+        self.assertGreater(events.index('b start'), events.index('a end'))
+        self.assertLess(events.index('c start'), events.index('a end'))
+        self.assertEqual(len(lock_table), 0)
+
+    def test_disabled_table_does_not_serialize(self):
+        lock_table = KeyLockTable(enabled=False)
+        events = []
+
+        async def commit(name):
+            async with lock_table.hold_async('p1'):
+                events.append(f'{name} start')
+                await asyncio.sleep(0.01)
+                events.append(f'{name} end')
+
+        async def run():
+            await asyncio.gather(commit('a'), commit('b'))
+
+        asyncio.run(run())
+
+        self.assertEqual(events[:2], ['a start', 'b start'])
+
+
+class TestExpectedHashId(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_async_blockchain()
+
+    def commit(self, data, block_type='EDIT', expected_hash_id=None):
+        return self.blockchain.commit_transaction(data, block_type, 'Provider', 'providerId',
+                                                  'p1', expected_hash_id)
+
+    def read(self):
+        return self.blockchain.find_one_with_hash_id('Provider', {'providerId': 'p1'})
+
+    def test_commits_at_the_expected_hash(self):
+        async def run():
+            await self.commit({'providerId': 'p1', 'n': 1}, 'CREATE')
+            _, hash_id = await self.read()
+            await self.commit({'providerId': 'p1', 'n': 2}, expected_hash_id=hash_id)
+            return await self.read()
+
+        document, _ = asyncio.run(run())
+
+        self.assertEqual(document, {'providerId': 'p1', 'n': 2})
+
+    def test_refuses_a_stale_expected_hash(self):
+        async def run():
+            await self.commit({'providerId': 'p1', 'n': 1}, 'CREATE')
+            _, stale_hash_id = await self.read()
+            await self.commit({'providerId': 'p1', 'n': 2})
+            _, current_hash_id = await self.read()
+
+            with self.assertRaises(CommitConflictError) as context:
+                await self.commit({'providerId': 'p1', 'n': 3}, expected_hash_id=stale_hash_id)
+
+            self.assertEqual(context.exception.current_hash_id, current_hash_id)
+            return await self.read()
+
+        document, _ = asyncio.run(run())
+
+        self.assertEqual(document, {'providerId': 'p1', 'n': 2})
+        self.assertEqual(self.database.Blocks.count_documents({}), 3)
+
+    def test_checks_the_expected_hash_again_when_writing(self):
+        async def run():
+            await self.commit({'providerId': 'p1', 'n': 1}, 'CREATE')
+
+            with mock.patch.object(AsyncMongoDb, 'get_current_hash_id', return_value='stale'):
+                with self.assertRaises(CommitConflictError):
+                    await self.commit({'providerId': 'p1', 'n': 2}, expected_hash_id='stale')
+
+            return await self.read()
+
+        document, _ = asyncio.run(run())
+
+        self.assertEqual(document, {'providerId': 'p1', 'n': 1})
+
+    def test_only_one_of_two_concurrent_edits_commits(self):
+        async def run():
+            await self.commit({'providerId': 'p1', 'n': 1}, 'CREATE')
+            _, hash_id = await self.read()
+            return await asyncio.gather(
+                self.commit({'providerId': 'p1', 'n': 2}, expected_hash_id=hash_id),
+                self.commit({'providerId': 'p1', 'n': 3}, expected_hash_id=hash_id),
+                return_exceptions=True)
+
+        results = asyncio.run(run())
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(sum(isinstance(result, CommitConflictError) for result in results), 1)
+
+
+class TestCommitConflictResponse(unittest.TestCase):
+    def test_conflict_is_reported_as_409(self):
+        handler = app.exception_handlers[AppCommitConflictError]
+
+        response = asyncio.run(handler(None, AppCommitConflictError('Provider', 'p1', 'a', 'b')))
+
+        self.assertEqual(response.status_code, 409)
@@ -0,0 +1,65 @@
+import asyncio
+from unittest import mock
+from blockchain import get_async_blockchain
+from blockchain.async_blockchain import AsyncBlockchain
+from blockchain.group_commit import GroupCommitter
+from blockchain.mongo import CreateBlockAlreadyExistsError
+from test.mongomock_case import MongomockTestCase
+
+
+def create_transaction(block_type, data_key_value, version=1):
+    return ({'providerId': data_key_value, 'version': version}, block_type, 'Provider',
+            'providerId', data_key_value)
+
+
+class TestFailedBlockInRun(MongomockTestCase):
+    TRANSACTIONS = [create_transaction('CREATE', 'p1'), create_transaction('CREATE', 'p1', 2),
+                    create_transaction('CREATE', 'p2'), create_transaction('EDIT', 'p1', 3)]
+
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_async_blockchain()
+
+    def assert_chain_links(self, block_count):
+        blocks = list(self.database.Blocks.find(sort=[('height', 1)]))
+
+        self.assertEqual([block['height'] for block in blocks], list(range(block_count)))
+        for previous_block, block in zip(blocks, blocks[1:]):
+            self.assertEqual(block['previous_hash'], previous_block['hash'])
+
+        return blocks
+
+    def assert_results(self, results):
+        self.assertEqual(results[0], True)
+        self.assertIsInstance(results[1], CreateBlockAlreadyExistsError)
+        self.assertEqual(results[2:], [True, True])
+
+    def assert_committed_after_the_failure(self):
+        blocks = self.assert_chain_links(4)
+
+        self.assertEqual(self.database.Provider.find_one({'providerId': 'p2'})['hash_id'],
+                         blocks[2]['hash'])
+        self.assertEqual(self.database.Provider.find_one(
+            {'providerId': 'p1', 'superceded': False})['version'], 3)
+
+    def test_blocks_after_a_failed_one_are_chained_again(self):
+        results = asyncio.run(self.blockchain.commit_transactions(self.TRANSACTIONS))
+
+        self.assert_results(results)
+        self.assert_committed_after_the_failure()
+
+    def test_group_commit_reports_the_failure_to_its_own_caller(self):
+        group_committer = GroupCommitter(enabled=True, window_seconds=0.05)
+
+        async def run():
+            return await asyncio.gather(
+                *(group_committer.submit(self.blockchain, transaction)
+                  for transaction in self.TRANSACTIONS), return_exceptions=True)
+
+        with mock.patch.object(AsyncBlockchain, 'commit_transactions', autospec=True,
+                               side_effect=AsyncBlockchain.commit_transactions) as commit:
+            results = asyncio.run(run())
+
+        self.assertEqual(commit.call_count, 1)
+        self.assert_results(results)
+        self.assert_committed_after_the_failure()
@@ -0,0 +1,65 @@
+import unittest
+from blockchain.merkle import PROOF_LEFT, PROOF_RIGHT, get_merkle_root, get_inclusion_proofs, \
+    verify_inclusion_proof
+
+
+def create_data(field_count):
+    return {f'field{index}': {'value': index} for index in range(field_count)}
+
+
+class TestInclusionProofs(unittest.TestCase):
+    def test_round_trip_for_every_tree_shape(self):
+        for field_count in range(1, 17):
+            data = create_data(field_count)
+            data_root = get_merkle_root(data)
+            proofs = get_inclusion_proofs(data)
+
+            for name, value in data.items():
+                self.assertTrue(verify_inclusion_proof(name, value, proofs[name], data_root),
+                                (field_count, name))
+
+    def test_proofs_are_logarithmic(self):
+        proofs = get_inclusion_proofs(create_data(64))
+
+        self.assertTrue(all(len(proof) == 6 for proof in proofs.values()))
+
+    def test_root_is_independent_of_field_order(self):
+        data = create_data(5)
+
+        self.assertEqual(get_merkle_root(data), get_merkle_root(dict(reversed(data.items()))))
+
+    def test_rejects_tampered_value(self):
+        data = create_data(5)
+        proofs = get_inclusion_proofs(data)
+
+        self.assertFalse(verify_inclusion_proof('field2', {'value': 3}, proofs['field2'],
+                                                get_merkle_root(data)))
+
+    def test_rejects_tampered_sibling(self):
+        data = create_data(5)
+        proof = get_inclusion_proofs(data)['field2']
+        proof[-1] = [proof[-1][0], 'ab' * 32]
+
+        self.assertFalse(verify_inclusion_proof('field2', {'value': 2}, proof,
+                                                get_merkle_root(data)))
+
+    def test_rejects_swapped_sides(self):
+        data = create_data(4)
+        proof = [[PROOF_RIGHT if side == PROOF_LEFT else PROOF_LEFT, sibling]
+                 for side, sibling in get_inclusion_proofs(data)['field1']]
+
+        self.assertFalse(verify_inclusion_proof('field1', {'value': 1}, proof,
+                                                get_merkle_root(data)))
+
+    def test_rejects_malformed_proof(self):
+        data = create_data(2)
+
+        self.assertFalse(verify_inclusion_proof('field0', {'value': 0}, [['L', 'not hex']],
+                                                get_merkle_root(data)))
+
+    def test_changing_any_field_changes_the_root(self):
+        data = create_data(7)
+        data_root = get_merkle_root(data)
+
+        for name in data:
+            self.assertNotEqual(get_merkle_root({**data, name: None}), data_root, name)
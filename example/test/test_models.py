@@ -0,0 +1,155 @@
+import json
+import unittest
+from hashlib import sha256
+from blockchain.models import Block, NakedBlock, DataBlock, HASH_VERSION_LEGACY, HASH_VERSION_CANONICAL, \
+    HASH_VERSION_MERKLE, serialize_block_for_hash, get_merkle_block_hash, verify_field_proof
+from blockchain.mongo import MERKLE_BLOCK_FIELDS, get_field_proof
+
+BLOCK_ID = 'a1b2c3'
+TIMESTAMP = '2021-04-12 10:00:00 +0000'
+PREVIOUS_HASH = 'f' * 64
+DATA = {'providerId': '7c9e6679-7425-40de-944b-e07fc1f90ae7',
+        'name': {'firstName': 'Zoë', 'lastName': 'Ng'},
+        'age': 42, 'rate': 1.5, 'active': True, 'notes': None, 'tags': ['a', 'b']}
+
+# Hash of the block above as computed by the original Block, before hash versions existed
+BASELINE_HASH = '05cc95df33a05c715d25fcc78e68cd85eb0b02fe92577b14be1bafb48a9a21ea'
+
+
+def create_block(hash_version, data=DATA):
+    return Block(BLOCK_ID, data, 'CREATE', TIMESTAMP, PREVIOUS_HASH, 'Provider', 'providerId',
+                 data['providerId'], hash_version=hash_version)
+
+
+class TestLegacyHash(unittest.TestCase):
+    def test_matches_baseline_hash(self):
+        self.assertEqual(create_block(HASH_VERSION_LEGACY).hash, BASELINE_HASH)
+
+    def test_matches_baseline_serialization(self):
+        baseline_fields = {'id': BLOCK_ID, 'block_type': 'CREATE', 'timestamp': TIMESTAMP,
+                           'previous_hash': PREVIOUS_HASH, 'data': json.dumps(DATA)}
+
+        self.assertEqual(serialize_block_for_hash(BLOCK_ID, 'CREATE', TIMESTAMP, PREVIOUS_HASH,
+                                                  json.dumps(DATA), HASH_VERSION_LEGACY),
+                         json.dumps(baseline_fields, sort_keys=True))
+
+
+class TestCanonicalHash(unittest.TestCase):
+    def test_embeds_serialized_data_unescaped(self):
+        serialized_data = json.dumps(DATA)
+
+        self.assertIn(f'"data":{serialized_data},',
+                      serialize_block_for_hash(BLOCK_ID, 'CREATE', TIMESTAMP, PREVIOUS_HASH,
+                                               serialized_data, HASH_VERSION_CANONICAL))
+
+    def test_covers_every_hashed_field(self):
+        block_hash = create_block(HASH_VERSION_CANONICAL).hash
+        changed_blocks = [
+            Block('other', DATA, 'CREATE', TIMESTAMP, PREVIOUS_HASH, 'Provider', 'providerId',
+                  DATA['providerId'], hash_version=HASH_VERSION_CANONICAL),
+            Block(BLOCK_ID, DATA, 'EDIT', TIMESTAMP, PREVIOUS_HASH, 'Provider', 'providerId',
+                  DATA['providerId'], hash_version=HASH_VERSION_CANONICAL),
+            Block(BLOCK_ID, DATA, 'CREATE', TIMESTAMP, '0' * 64, 'Provider', 'providerId',
+                  DATA['providerId'], hash_version=HASH_VERSION_CANONICAL),
+            create_block(HASH_VERSION_CANONICAL, {**DATA, 'age': 43}),
+        ]
+
+        for block in changed_blocks:
+            self.assertNotEqual(block.hash, block_hash)
+
+    def test_differs_from_legacy_hash(self):
+        self.assertNotEqual(create_block(HASH_VERSION_CANONICAL).hash, BASELINE_HASH)
+
+    def test_rejects_unknown_version(self):
+        with self.assertRaises(ValueError):
+            create_block(99)
+
+
+class TestBlockViews(unittest.TestCase):
+    def setUp(self):
+        self.block = Block(BLOCK_ID, DATA, 'CREATE', TIMESTAMP, PREVIOUS_HASH, 'Provider',
+                           'providerId', DATA['providerId'], 7, HASH_VERSION_CANONICAL)
+
+    def test_blocks_have_no_instance_dict(self):
+        for value in (self.block, self.block.get_naked_block(), self.block.get_data_block()):
+            self.assertFalse(hasattr(value, '__dict__'), type(value).__name__)
+
+    def test_views_read_through_to_the_block(self):
+        naked_block = self.block.get_naked_block()
+        data_block = self.block.get_data_block()
+
+        self.assertIsInstance(naked_block, NakedBlock)
+        self.assertIsInstance(data_block, DataBlock)
+        self.assertIs(naked_block.block, self.block)
+        self.assertIs(data_block.data, self.block.data)
+        self.assertEqual((naked_block.hash, naked_block.height), (self.block.hash, 7))
+
+    def test_naked_block_document(self):
+        self.assertEqual(self.block.get_naked_block().get_document(), {
+            'id': BLOCK_ID, 'block_type': 'CREATE', 'timestamp': TIMESTAMP,
+            'previous_hash': PREVIOUS_HASH, 'hash': self.block.hash, 'height': 7,
+            'hash_version': HASH_VERSION_CANONICAL})
+
+    def test_data_block_document(self):
+        document = self.block.get_data_block().get_document()
+
+        self.assertEqual({name: document[name] for name in DATA}, DATA)
+        self.assertEqual((document['hash_id'], document['block_type'], document['superceded'],
+                          document['block_height']), (self.block.hash, 'CREATE', False, 7))
+
+    def test_set_superceded_updates_the_block(self):
+        self.block.get_data_block().set_superceded()
+
+        self.assertTrue(self.block.superceded)
+        self.assertTrue(self.block.get_data_block().get_document()['superceded'])
+
+
+class TestMerkleHash(unittest.TestCase):
+    def setUp(self):
+        self.block = create_block(HASH_VERSION_MERKLE)
+        self.block_document = self.block.get_naked_block().get_document()
+        self.data_document = self.block.get_data_block().get_document()
+
+    def get_field_proof(self, field):
+        return get_field_proof(self.data_document, self.block_document, field)
+
+    def test_block_hash_is_recomputed_from_data_root(self):
+        self.assertEqual(get_merkle_block_hash(self.block_document), self.block.hash)
+
+    def test_every_field_proof_verifies(self):
+        for field in DATA:
+            self.assertTrue(verify_field_proof(self.get_field_proof(field)), field)
+
+    def test_proof_holds_only_the_block_fields(self):
+        self.assertEqual(set(self.get_field_proof('age')['block']), set(MERKLE_BLOCK_FIELDS))
+
+    def test_rejects_tampered_value(self):
+        field_proof = self.get_field_proof('age')
+        field_proof['value'] = 43
+
+        self.assertFalse(verify_field_proof(field_proof))
+
+    def test_rejects_tampered_sibling(self):
+        field_proof = self.get_field_proof('name')
+        side, sibling = field_proof['proof'][0]
+        field_proof['proof'][0] = [side, sha256(sibling.encode()).hexdigest()]
+
+        self.assertFalse(verify_field_proof(field_proof))
+
+    def test_rejects_tampered_data_root(self):
+        field_proof = self.get_field_proof('name')
+        field_proof['block']['data_root'] = '0' * 64
+
+        self.assertFalse(verify_field_proof(field_proof))
+
+    def test_rejects_proof_for_another_field(self):
+        field_proof = self.get_field_proof('age')
+        field_proof['field'] = 'rate'
+
+        self.assertFalse(verify_field_proof(field_proof))
+
+    def test_no_proof_for_older_versions(self):
+        block = create_block(HASH_VERSION_CANONICAL)
+
+        self.assertIsNone(get_field_proof(block.get_data_block().get_document(),
+                                          block.get_naked_block().get_document(), 'age'))
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from blockchain import get_blockchain, InvalidPageTokenError
+from blockchain.mongo import MAX_PAGE_SIZE, decode_page_token, encode_page_token
+from app.main import app
+from app.api.blockchain import InvalidPageTokenError as AppInvalidPageTokenError
+from test.mongomock_case import MongomockTestCase
+
+
+class TestFindPage(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_blockchain()
+
+        for index in range(5):
+            self.blockchain.commit_transaction({'providerId': f'p{index}', 'index': index},
+                                               'CREATE', 'Provider', 'providerId', f'p{index}')
+
+    def find_page(self, limit, page_token=None):
+        documents, next_page_token = self.blockchain.find_page('Provider', {}, limit, page_token)
+        return [document['index'] for document in documents], next_page_token
+
+    def test_pages_cover_every_document_newest_first(self):
+        first_page, page_token = self.find_page(2)
+        second_page, page_token = self.find_page(2, page_token)
+        last_page, page_token = self.find_page(2, page_token)
+
+        self.assertEqual([first_page, second_page, last_page], [[4, 3], [2, 1], [0]])
+        self.assertIsNone(page_token)
+
+    def test_no_token_when_the_page_ends_on_the_last_document(self):
+        self.assertEqual(self.find_page(5), ([4, 3, 2, 1, 0], None))
+
+    def test_limit_is_capped(self):
+        self.assertEqual(len(self.find_page(0)[0]), 1)
+        self.assertEqual(len(self.find_page(MAX_PAGE_SIZE + 1)[0]), 5)
+
+    def test_malformed_tokens_are_refused(self):
+        for page_token in ('!', 'a', 'YWJj', ''):
+            with self.assertRaises(InvalidPageTokenError, msg=page_token):
+                self.find_page(2, page_token)
+
+    def test_token_round_trip(self):
+        document = self.database.Provider.find_one({'providerId': 'p0'})
+
+        self.assertEqual(decode_page_token(encode_page_token(document['_id'])), document['_id'])
+
+
+class TestInvalidPageTokenResponse(unittest.TestCase):
+    def test_invalid_token_is_reported_as_400(self):
+        handler = app.exception_handlers[AppInvalidPageTokenError]
+
+        response = asyncio.run(handler(None, AppInvalidPageTokenError('!')))
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+from blockchain import get_blockchain, audit_cache
+from blockchain import mongo
+from blockchain.mongo import get_projection, project_document
+from blockchain.async_mongo import AsyncMongoDb
+from blockchain.models import HASH_VERSION_MERKLE
+from test.mongomock_case import MongomockTestCase
+
+DOCUMENT = {
+    'providerId': 'p',
+    'name': {'firstName': 'Ann', 'lastName': 'Ng'},
+    'phones': [{'type': 'home', 'number': '1'}, {'type': 'work'}, 'not a document'],
+    'notes': None,
+}
+
+
+class TestProjectDocument(unittest.TestCase):
+    def test_top_level_fields(self):
+        self.assertEqual(project_document(DOCUMENT, ['providerId', 'notes']),
+                         {'providerId': 'p', 'notes': None})
+
+    def test_nested_fields_are_merged(self):
+        self.assertEqual(project_document(DOCUMENT, ['name.firstName', 'name.lastName']),
+                         {'name': {'firstName': 'Ann', 'lastName': 'Ng'}})
+
+    def test_arrays_of_documents(self):
+        self.assertEqual(project_document(DOCUMENT, ['phones.number']),
+                         {'phones': [{'number': '1'}, {}]})
+
+    def test_missing_fields(self):
+        self.assertEqual(project_document(DOCUMENT, ['missing', 'providerId.missing']), {})
+
+
+class TestGetProjection(unittest.TestCase):
+    def test_full_documents(self):
+        self.assertEqual(get_projection(None), {'block_type': 0})
+
+    def test_reads_top_level_fields_and_their_proofs(self):
+        self.assertEqual(get_projection(['name.firstName', 'name.lastName', 'notes']),
+                         {'name': 1, 'notes': 1, 'data_proofs.name': 1,
+                          'data_proofs.notes': 1, 'hash_id': 1})
+
+
+class TestProjectedFind(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blockchain = get_blockchain()
+
+        for index in range(3):
+            self.blockchain.commit_transaction(
+                {'providerId': f'p{index}', 'name': {'firstName': f'F{index}', 'lastName': 'L'},
+                 'notes': 'n'}, 'CREATE', 'Provider', 'providerId', f'p{index}')
+
+        audit_cache.clear()
+
+    def test_full_documents_are_read_once_without_merkle_blocks(self):
+        with mock.patch.object(AsyncMongoDb, '_AsyncMongoDb__get_documents_by_id',
+                               side_effect=AssertionError('documents read again')):
+            results = self.blockchain.find('Provider', {}, ['name.firstName'])
+
+        self.assertEqual(results, [{'name': {'firstName': f'F{index}'}} for index in (2, 1, 0)])
+
+    def test_tampered_documents_are_left_out(self):
+        self.database.Provider.update_one({'providerId': 'p1'}, {'$set': {'notes': 'x'}})
+
+        self.assertEqual(self.blockchain.find('Provider', {}, ['notes']),
+                         [{'notes': 'n'}, {'notes': 'n'}])
+
+    def test_older_blocks_are_read_again_when_projecting_on_the_server(self):
+        get_documents_by_id = AsyncMongoDb._AsyncMongoDb__get_documents_by_id
+        calls = []
+
+        async def record_call(database, collection_name, document_ids):
+            calls.append(len(document_ids))
+            return await get_documents_by_id(database, collection_name, document_ids)
+
+        with mock.patch.object(mongo, 'CURRENT_HASH_VERSION', HASH_VERSION_MERKLE), \
+                mock.patch.object(AsyncMongoDb, '_AsyncMongoDb__get_documents_by_id', record_call):
+            results, _ = self.blockchain.find_page('Provider', {}, 2, None, ['notes'])
+
+        self.assertEqual(results, [{'notes': 'n'}, {'notes': 'n'}])
+        self.assertEqual(calls, [2])
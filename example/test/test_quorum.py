@@ -0,0 +1,129 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+from blockchain.async_blockchain import AsyncBlockchain, confer_with_nodes, \
+    get_required_node_count
+from blockchain.membership import membership
+from blockchain.peers import peer_sessions
+
+
+class NodeResponse:
+    def __init__(self, result, status_code=200):
+        self.result = result
+        self.status_code = status_code
+        self.text = str(result)
+
+    def json(self):
+        return self.result
+
+
+def create_post(responses, delays):
+    """Fake PeerSessions.post answering with the response of each node after its delay"""
+    cancelled = set()
+
+    async def post(node, path, content):
+        try:
+            await asyncio.sleep(delays.get(node, 0))
+        except asyncio.CancelledError:
+            cancelled.add(node)
+            raise
+        return responses.get(node)
+
+    return post, cancelled
+
+
+class TestRequiredNodeCount(unittest.TestCase):
+    def test_default_ratio_thresholds(self):
+        expected_counts = {1: 1, 2: 2, 3: 3, 4: 4, 5: 4, 6: 5, 7: 6, 8: 7}
+
+        for node_count, expected_count in expected_counts.items():
+            self.assertEqual(get_required_node_count(node_count, 0.75), expected_count,
+                             node_count)
+
+    def test_majority_thresholds(self):
+        expected_counts = {1: 1, 2: 2, 3: 2, 4: 3, 5: 3, 6: 4, 7: 4, 8: 5}
+
+        for node_count, expected_count in expected_counts.items():
+            self.assertEqual(get_required_node_count(node_count, 0.5), expected_count,
+                             node_count)
+
+    def test_required_share_is_strictly_greater_than_ratio(self):
+        for node_count in range(1, 9):
+            required_count = get_required_node_count(node_count, 0.75)
+
+            self.assertTrue(required_count == node_count
+                            or required_count / node_count > 0.75, node_count)
+            self.assertLessEqual((required_count - 1) / node_count, 0.75, node_count)
+
+
+class TestConferWithNodes(unittest.TestCase):
+    NODES = ('a', 'b', 'c', 'd', 'e')
+
+    def confer(self, responses, delays=None, node_count=None, nodes=NODES):
+        post, cancelled = create_post(responses, delays or {})
+
+        with mock.patch.object(peer_sessions, 'post', post):
+            result = asyncio.run(confer_with_nodes(nodes, '/path', '', 'hash', node_count))
+
+        return result, cancelled
+
+    def test_resolves_once_quorum_is_reached(self):
+        result, cancelled = self.confer({node: NodeResponse('hash') for node in self.NODES},
+                                        {'e': 10})
+
+        self.assertTrue(result)
+        self.assertEqual(cancelled, {'e'})
+
+    def test_resolves_once_quorum_can_no_longer_be_reached(self):
+        result, cancelled = self.confer({'a': NodeResponse('other'), 'b': NodeResponse('other'),
+                                         'c': NodeResponse('hash'), 'd': NodeResponse('hash'),
+                                         'e': NodeResponse('hash')},
+                                        {'c': 10, 'd': 10, 'e': 10})
+
+        self.assertFalse(result)
+        self.assertEqual(cancelled, {'c', 'd', 'e'})
+
+    def test_unreachable_and_failing_nodes_disagree(self):
+        result, _ = self.confer({'a': NodeResponse('hash'), 'b': NodeResponse('hash'),
+                                 'c': NodeResponse('hash'), 'd': NodeResponse('hash', 500)})
+
+        self.assertFalse(result)
+
+    def test_nodes_left_out_still_count_towards_quorum(self):
+        responses = {node: NodeResponse('hash') for node in self.NODES}
+
+        self.assertTrue(self.confer(responses, nodes=self.NODES[:4], node_count=5)[0])
+        self.assertFalse(self.confer(responses, nodes=self.NODES[:3], node_count=5)[0])
+
+
+class TestConferWithOtherNodes(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.dict(os.environ, {'CONNECTION_STRING': 'mongodb://localhost',
+                                             'DATABASE': 'test'})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def confer(self, nodes, healthy_nodes):
+        post, _ = create_post({node: NodeResponse('hash') for node in nodes}, {})
+        contacted = []
+
+        async def record_post(node, path, content):
+            contacted.append(node)
+            return await post(node, path, content)
+
+        with mock.patch.object(membership, 'get_snapshot', return_value=(nodes, healthy_nodes)), \
+                mock.patch.object(peer_sessions, 'post', record_post):
+            result = asyncio.run(AsyncBlockchain().confer_with_other_nodes('/path', '', 'hash'))
+
+        return result, sorted(contacted)
+
+    def test_only_healthy_nodes_are_sent_blocks_while_they_can_reach_quorum(self):
+        nodes = ('a', 'b', 'c', 'd', 'e')
+
+        self.assertEqual(self.confer(nodes, ('a', 'b', 'c', 'd')), (True, ['a', 'b', 'c', 'd']))
+
+    def test_every_node_is_sent_blocks_when_the_healthy_ones_cannot_reach_quorum(self):
+        nodes = ('a', 'b', 'c', 'd')
+
+        self.assertEqual(self.confer(nodes, ('a', 'b', 'c')), (True, ['a', 'b', 'c', 'd']))
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+from blockchain import get_async_blockchain, commit_retry_policy, retry_metrics
+from blockchain.retry import RetryPolicy, RETRY_HEAD_CHANGED, RETRY_QUORUM_FAILED
+from blockchain.mongo import BlockHeightConflictError
+from blockchain.async_mongo import AsyncMongoDb
+from test.mongomock_case import MongomockTestCase
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_retries_until_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+
+        self.assertEqual([policy.should_retry(attempt) for attempt in (1, 2, 3)],
+                         [True, True, False])
+
+    def test_delay_is_jittered_below_the_exponential_cap(self):
+        policy = RetryPolicy(base_delay_seconds=0.1, max_delay_seconds=0.3)
+
+        for attempt, cap in ((1, 0.1), (2, 0.2), (3, 0.3), (4, 0.3)):
+            delays = [policy.get_delay(attempt) for _ in range(100)]
+
+            self.assertTrue(all(0 <= delay <= cap for delay in delays), attempt)
+
+
+class TestCommitRetry(MongomockTestCase):
+    def setUp(self):
+        super().setUp()
+        retry_metrics.reset()
+        self.addCleanup(retry_metrics.reset)
+        self.blockchain = get_async_blockchain()
+        self.sleeps = []
+        asyncio.run(self.blockchain.ensure_genesis_block())
+
+        async def record_sleep(delay):
+            self.sleeps.append(delay)
+
+        patches = [
+            mock.patch.object(commit_retry_policy, 'max_attempts', 3),
+            mock.patch.object(commit_retry_policy, 'get_delay', return_value=0.25),
+            mock.patch('blockchain.async_blockchain.asyncio.sleep', record_sleep),
+            mock.patch.object(time, 'sleep', side_effect=AssertionError('blocking sleep')),
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def commit(self):
+        return asyncio.run(self.blockchain.commit_transaction(
+            {'providerId': 'p1'}, 'CREATE', 'Provider', 'providerId', 'p1'))
+
+    def test_rejected_quorum_is_retried_after_awaiting_the_backoff(self):
+        with mock.patch.object(self.blockchain, 'validate_block', side_effect=[False, True]):
+            self.assertTrue(self.commit())
+
+        self.assertEqual(self.sleeps, [0.25])
+        self.assertEqual(retry_metrics.stats()['retries'], {RETRY_QUORUM_FAILED: 1})
+        self.assertEqual(retry_metrics.stats()['mean_attempts'], 2)
+
+    def test_moved_head_is_retried(self):
+        commit_block = AsyncMongoDb.commit_block
+        results = [BlockHeightConflictError(1)]
+
+        async def conflict_once(database, block, expected_hash_id=None):
+            if len(results) > 0:
+                raise results.pop()
+            return await commit_block(database, block, expected_hash_id)
+
+        with mock.patch.object(AsyncMongoDb, 'commit_block', conflict_once):
+            self.assertTrue(self.commit())
+
+        self.assertEqual(self.sleeps, [0.25])
+        self.assertEqual(retry_metrics.stats()['retries'], {RETRY_HEAD_CHANGED: 1})
+
+    def test_gives_up_after_max_attempts(self):
+        with mock.patch.object(self.blockchain, 'validate_block', return_value=False):
+            self.assertFalse(self.commit())
+
+        self.assertEqual(self.sleeps, [0.25, 0.25])
+        self.assertEqual(retry_metrics.stats()['exhausted'], 1)
+
+    def test_rejected_run_is_retried_after_awaiting_the_backoff(self):
+        with mock.patch.object(self.blockchain, 'validate_blocks', side_effect=[False, True]):
+            results = asyncio.run(self.blockchain.commit_transactions(
+                [({'providerId': f'p{index}'}, 'CREATE', 'Provider', 'providerId', f'p{index}')
+                 for index in range(3)]))
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(self.sleeps, [0.25])
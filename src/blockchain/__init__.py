@@ -1,4 +1,20 @@
 """Grouping for blockchain related things"""
 
-from .blockchain import Blockchain as BlockchainDb
+from .blockchain import Blockchain as BlockchainDb, start_chain_head_watcher, \
+    stop_chain_head_watcher, get_blockchain, close_blockchain
+from .async_blockchain import AsyncBlockchain as AsyncBlockchainDb, get_async_blockchain, \
+    close_async_blockchain
 from .api import blockchain_api
+from .mongo import open_connection_pool, close_connection_pool, ensure_indexes, \
+    register_collection, CreateBlockAlreadyExistsError, CommitConflictError, InvalidPageTokenError
+from .async_mongo import close_async_connection_pool
+from .cache import audit_cache, chain_head
+from .peers import close_peer_sessions
+from .membership import membership, start_membership_refresh, stop_membership_refresh, \
+    StaticDiscovery, FileDiscovery, AwsCloudMapDiscovery
+from .locks import commit_locks
+from .retry import commit_retry_policy, retry_metrics
+from .bloom import key_filters
+from .audit import AuditAlreadyRunningError
+from .models import verify_field_proof
+from .encoder import HelperEncoder, register_encoder, iter_json_array, aiter_json_array
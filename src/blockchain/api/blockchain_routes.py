@@ -1,22 +1,58 @@
 """Routes that are related to the actual blockchain"""
 
-from fastapi import Depends, APIRouter, status
-from ..blockchain import Blockchain as BlockchainDb
+from typing import List
+from fastapi import Depends, APIRouter, status, HTTPException
+from ..blockchain import Blockchain as BlockchainDb, get_blockchain
 from ..models import ProposedBlock
+from ..retry import retry_metrics
 
 api = APIRouter(
     prefix="/api/blockchain",
     tags=["blockchain"],
-    dependencies=[Depends(BlockchainDb)],
+    dependencies=[Depends(get_blockchain)],
     responses={404: {"description": "Not found"}},
 )
 
+MAX_BLOCK_RANGE = 10000
+
+@api.get("/ping")
+def ping():
+    """Lightweight endpoint other nodes use to health check this node"""
+    return 200
+
 @api.get("/health")
-def get_client(database: BlockchainDb = Depends()):
-    """Endpoint to validate the blockchain as a whole"""
+def get_client(database: BlockchainDb = Depends(get_blockchain)):
+    """
+    Endpoint to validate the blockchain as a whole. Only blocks added since the last check
+    are verified, a full verification is on the admin api.
+    """
     return 200 if database.validate() else 400
 
+@api.get("/blocks")
+def get_blocks(start: int, end: int, database: BlockchainDb = Depends(get_blockchain)):
+    """Endpoint to return the blocks between two heights"""
+    if end < start or end - start >= MAX_BLOCK_RANGE:
+        raise HTTPException(status_code=400,
+                            detail=f'Block range must be between 1 and {MAX_BLOCK_RANGE} blocks')
+
+    return database.get_blocks(start, end)
+
+@api.get("/fork")
+def get_fork(start: int = 0, database: BlockchainDb = Depends(get_blockchain)):
+    """Endpoint to find the first height at which the chain is broken"""
+    return {'height': database.find_fork(start)}
+
+@api.get("/metrics")
+def get_metrics():
+    """Endpoint to report commit retry counts for this node"""
+    return {'commit_retries': retry_metrics.stats()}
+
 @api.post("/validate-block", status_code=status.HTTP_200_OK)
-def update_client(proposed_block: ProposedBlock, database: BlockchainDb = Depends()):
+def update_client(proposed_block: ProposedBlock, database: BlockchainDb = Depends(get_blockchain)):
     """Endpoint to validate a single block"""
     return database.get_proposed_block_hash(proposed_block)
+
+@api.post("/validate-blocks", status_code=status.HTTP_200_OK)
+def validate_blocks(proposed_blocks: List[ProposedBlock], database: BlockchainDb = Depends(get_blockchain)):
+    """Endpoint to validate a run of chained blocks"""
+    return database.get_proposed_block_hashes(proposed_blocks)
@@ -0,0 +1,492 @@
+"""Asynchronous implementation of the blockchain, also backing the synchronous Blockchain"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from .async_mongo import AsyncMongoDb
+from .mongo import MAX_PAGE_SIZE, BlockHeightConflictError, CommitConflictError, \
+    CreateBlockAlreadyExistsError
+from .cache import chain_head
+from .bloom import key_filters
+from .peers import peer_sessions
+from .membership import membership
+from .group_commit import group_committer
+from .locks import commit_locks
+from .retry import RETRY_HEAD_CHANGED, RETRY_QUORUM_FAILED, commit_retry_policy, \
+    retry_metrics
+from .models import Block, ProposedBlock, generate_block, generate_from_proposed_block
+
+
+QUORUM_RATIO = float(os.environ.get('QUORUM_RATIO', 0.75))
+
+_async_blockchain = None
+_async_blockchain_lock = threading.Lock()
+
+
+class AsyncBlockchain:
+    """
+    Primary implementation of the blockchain. Reads are awaited on motor from the calling
+    event loop so a single worker can have many reads in flight at once. Commits are moved
+    onto the shared loop of peer_sessions and awaited there, so the key locks, the group
+    committer and the retry backoff of every commit in the process share one loop without
+    tying up a thread per commit.
+    """
+    def __init__(self):
+        self.database = AsyncMongoDb()
+
+    async def ensure_genesis_block(self):
+        """Creates the genesys block for the chain if the chain is empty"""
+        if (await self.database.get_head())[0] != '':
+            return
+
+        try:
+            await self.__commit(Block([], 'GENISYS', '', '', '', '', '', '', 0))
+        except BlockHeightConflictError:
+            logging.info('Genisys block was already created by another process')
+
+    async def commit_transaction(self, transaction, block_type, data_collection_name,
+                                 data_key_field_name, data_key_value, expected_hash_id=None):
+        """
+        Handles the commit for any transaction either create or edit. A commit rejected
+        because the head moved or the quorum was not reached is retried according to
+        commit_retry_policy; the block is only regenerated when the head has changed.
+        When expected_hash_id is given the transaction only commits while the current data
+        for the key is at that hash and raises a CommitConflictError otherwise, checked
+        before conferring with the other nodes and again when the block is written.
+        A CREATE for a key the key filter may already hold is refused the same way with a
+        CreateBlockAlreadyExistsError. Commits to the same key in this process are
+        serialized through commit_locks.
+        """
+        return await peer_sessions.run_async(self.__commit_keyed_transaction(
+            transaction, block_type, data_collection_name, data_key_field_name, data_key_value,
+            expected_hash_id))
+
+    async def __commit_keyed_transaction(self, transaction, block_type, data_collection_name,
+                                         data_key_field_name, data_key_value, expected_hash_id):
+        async with commit_locks.hold_async((data_collection_name, str(data_key_value))):
+            if expected_hash_id is not None:
+                current_hash_id = await self.database.get_current_hash_id(
+                    data_collection_name, data_key_field_name, data_key_value)
+
+                if current_hash_id != expected_hash_id:
+                    raise CommitConflictError(data_collection_name, data_key_value,
+                                              expected_hash_id, current_hash_id)
+
+            if block_type == 'CREATE' \
+                    and key_filters.might_contain(data_collection_name, data_key_value) \
+                    and await self.database.data_key_exists(data_collection_name, data_key_value):
+                raise CreateBlockAlreadyExistsError(data_key_field_name, str(data_key_value))
+
+            if group_committer.enabled:
+                return await group_committer.submit(self, (transaction, block_type,
+                                                           data_collection_name,
+                                                           data_key_field_name, data_key_value,
+                                                           expected_hash_id))
+
+            return await self.__commit_transaction(transaction, block_type,
+                                                   data_collection_name, data_key_field_name,
+                                                   data_key_value, expected_hash_id)
+
+    async def __commit_transaction(self, transaction, block_type, data_collection_name,
+                                   data_key_field_name, data_key_value, expected_hash_id):
+        attempt = 1
+        new_block = None
+
+        while True:
+            previous_hash, height = await self.get_head()
+
+            if height < 0:
+                await self.ensure_genesis_block()
+                chain_head.invalidate()
+                continue
+
+            if new_block is None or new_block.previous_hash != previous_hash:
+                new_block = generate_block(
+                    transaction, block_type,
+                    datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %z"),
+                    previous_hash, data_collection_name, data_key_field_name, data_key_value,
+                    height + 1)
+
+                logging.info(f'New block created with hash: {new_block.hash}')
+
+            if await self.validate_block(new_block):
+                try:
+                    await self.__commit(new_block, expected_hash_id)
+                    retry_metrics.record_commit(attempt)
+                    return True
+                except BlockHeightConflictError:
+                    logging.info(f'Block at height {new_block.height} already committed. '
+                                 'Block rejected.')
+                    reason = RETRY_HEAD_CHANGED
+            else:
+                logging.info('Not enough successful results for block. Block rejected.')
+                reason = RETRY_QUORUM_FAILED
+
+            chain_head.invalidate()
+
+            if not commit_retry_policy.should_retry(attempt):
+                retry_metrics.record_exhausted()
+                return False
+
+            retry_metrics.record_retry(reason)
+            await asyncio.sleep(commit_retry_policy.get_delay(attempt))
+            attempt += 1
+
+    async def commit_transactions(self, transactions):
+        """
+        Commits several transactions as a run of chained blocks that is conferred with the
+        other nodes in a single round. Each transaction is a tuple of the commit_transaction
+        arguments, optionally ending with the expected_hash_id. Returns one result per
+        transaction: True if committed, False if it was rejected by the other nodes, or the
+        exception raised while committing it.
+        """
+        return await peer_sessions.run_async(self.__commit_transactions(transactions))
+
+    async def __commit_transactions(self, transactions):
+        attempt = 1
+        results = [False] * len(transactions)
+        remaining = list(range(len(transactions)))
+        expected_hash_ids = [transaction[5] if len(transaction) > 5 else None
+                             for transaction in transactions]
+
+        while len(remaining) > 0 and attempt <= commit_retry_policy.max_attempts:
+            timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %z")
+            previous_hash, height = await self.get_head()
+
+            if height < 0:
+                await self.ensure_genesis_block()
+                chain_head.invalidate()
+                continue
+
+            new_blocks = []
+
+            for index in remaining:
+                transaction, block_type, data_collection_name, data_key_field_name, \
+                    data_key_value = transactions[index][:5]
+                height += 1
+                new_block = generate_block(transaction, block_type, timestamp, previous_hash,
+                                           data_collection_name, data_key_field_name,
+                                           data_key_value, height)
+                new_blocks.append(new_block)
+                previous_hash = new_block.hash
+
+            logging.info(f'New block run created with {len(new_blocks)} blocks')
+
+            if not await self.validate_blocks(new_blocks):
+                logging.info('Not enough successful results for block run. Blocks rejected.')
+                chain_head.invalidate()
+
+                if commit_retry_policy.should_retry(attempt):
+                    retry_metrics.record_retry(RETRY_QUORUM_FAILED)
+                    await asyncio.sleep(commit_retry_policy.get_delay(attempt))
+                attempt += 1
+                continue
+
+            committed = 0
+            failed = 0
+
+            for index, new_block in zip(remaining, new_blocks):
+                try:
+                    await self.__commit(new_block, expected_hash_ids[index])
+                except BlockHeightConflictError:
+                    logging.info(f'Block at height {new_block.height} already committed. '
+                                 'Block run rejected.')
+
+                    if commit_retry_policy.should_retry(attempt):
+                        retry_metrics.record_retry(RETRY_HEAD_CHANGED)
+                        await asyncio.sleep(commit_retry_policy.get_delay(attempt))
+                    attempt += 1
+                    break
+                except Exception as error:
+                    logging.info(f'Block {new_block.hash} in run failed to commit: {error}')
+                    results[index] = error
+                    failed = 1
+                    break
+                results[index] = True
+                retry_metrics.record_commit(attempt)
+                committed += 1
+
+            # Blocks after a failed commit were chained onto it so they are regenerated
+            remaining = remaining[committed + failed:]
+
+        if len(remaining) > 0:
+            retry_metrics.record_exhausted()
+
+        return results
+
+    async def __commit(self, block: Block, expected_hash_id=None):
+        """
+        Starts the process to add a block to the blockchain
+        """
+        try:
+            await self.database.commit_block(block, expected_hash_id)
+        except Exception:
+            chain_head.invalidate()
+            raise
+
+        chain_head.set((block.hash, block.height))
+        return block
+
+    async def get_proposed_block_hash(self, proposed_block: ProposedBlock):
+        """
+        Generates a block that is potentially to be added to the blockchain. The block is
+        chained onto the head read from the database, see read_head.
+        """
+        logging.debug(f'proposed: {proposed_block}')
+        block = generate_from_proposed_block(proposed_block, (await self.read_head())[0])
+        logging.debug(block)
+        return block.hash
+
+    async def get_proposed_block_hashes(self, proposed_blocks):
+        """
+        Generates a run of chained blocks that are potentially to be added to the blockchain,
+        chained onto the head read from the database
+        """
+        previous_hash = (await self.read_head())[0]
+        block_hashes = []
+
+        for proposed_block in proposed_blocks:
+            previous_hash = generate_from_proposed_block(proposed_block, previous_hash).hash
+            block_hashes.append(previous_hash)
+
+        return block_hashes
+
+    async def validate_block(self, block: Block):
+        """
+        Dispatchs blocks for comparison against other nodes and determines
+        the results
+        """
+        if len(membership.nodes) == 0:
+            return True
+
+        proposed_block = block.get_proposed_block()
+
+        logging.info('Starting node conferral process')
+        is_valid = await peer_sessions.run_async(
+            self.validate_with_other_nodes(proposed_block, block.hash))
+
+        logging.info(f'Node conferral result: {is_valid}')
+
+        return is_valid
+
+    async def validate_blocks(self, blocks):
+        """
+        Dispatchs a run of chained blocks for comparison against other nodes in one request
+        and determines the results
+        """
+        if len(membership.nodes) == 0:
+            return True
+
+        proposed_blocks = [block.get_proposed_block() for block in blocks]
+
+        logging.info('Starting node conferral process for block run')
+        is_valid = await peer_sessions.run_async(self.validate_batch_with_other_nodes(
+            proposed_blocks, [block.hash for block in blocks]))
+
+        logging.info(f'Node conferral result: {is_valid}')
+
+        return is_valid
+
+    async def validate_with_other_nodes(self, proposed_block, block_hash):
+        """
+        Handles the coallation of the block validation requests
+        """
+        return await self.confer_with_other_nodes('/api/blockchain/validate-block',
+                                                  proposed_block.json(), block_hash)
+
+    async def validate_batch_with_other_nodes(self, proposed_blocks, block_hashes):
+        """
+        Handles the coallation of the block run validation requests
+        """
+        content = json.dumps([proposed_block.dict() for proposed_block in proposed_blocks])
+
+        return await self.confer_with_other_nodes('/api/blockchain/validate-blocks',
+                                                  content, block_hashes)
+
+    async def confer_with_other_nodes(self, path, content, expected_result):
+        """
+        Sends the content to every healthy node and checks enough of them respond with the
+        expected result. When the healthy nodes alone cannot reach the quorum the content is
+        sent to every node, so a node that failed a single health check does not reject every
+        commit until the next membership refresh.
+        """
+        nodes, healthy_nodes = membership.get_snapshot()
+
+        if len(healthy_nodes) < get_required_node_count(len(nodes), QUORUM_RATIO):
+            healthy_nodes = nodes
+
+        return await confer_with_nodes(healthy_nodes, path, content, expected_result,
+                                       len(nodes))
+
+    async def find_one(self, collection_name, query, fields=None):
+        """
+        Wrapper to call to find a single node and its real value in the database. When
+        fields is given only those fields are read and returned, still verified.
+        """
+        return await self.database.find_one(collection_name, query, fields)
+
+    async def find_one_with_hash_id(self, collection_name, query):
+        """
+        Finds a single node and the hash of the block it was committed in, to pass as the
+        expected_hash_id when committing changes made to it
+        """
+        return await self.database.find_one_with_hash_id(collection_name, query)
+
+    async def find(self, collection_name, query, fields=None):
+        """
+        Wrapper to call to find a multiple nodes and their real values in the database,
+        optionally only the given fields
+        """
+        return await self.database.find(collection_name, query, fields)
+
+    def find_iter(self, collection_name, query, fields=None):
+        """
+        Wrapper to stream multiple nodes and their real values from the database as an
+        async iterator without holding them all in memory
+        """
+        return self.database.find_iter(collection_name, query, fields)
+
+    async def find_one_as_of(self, collection_name, query, at):
+        """
+        Wrapper to find a single node as it was at a block height or a datetime, so past
+        states can be read in one indexed query instead of replaying the chain
+        """
+        return await self.database.find_one_as_of(collection_name, query, at)
+
+    async def get_field_proof(self, collection_name, query, field):
+        """
+        Wrapper to get a proof of a single top level field of a node, verifiable with
+        verify_field_proof against the block hash alone. Needs BLOCK_HASH_VERSION=3.
+        """
+        return await self.database.get_field_proof(collection_name, query, field)
+
+    def find_history(self, collection_name, data_key_field_name, data_key_value):
+        """
+        Wrapper to iterate asynchronously over every version of a node, oldest first, as
+        tuples of block height, block timestamp and the document
+        """
+        return self.database.find_history(collection_name, data_key_field_name, data_key_value)
+
+    async def find_page(self, collection_name, query, limit=MAX_PAGE_SIZE, page_token=None,
+                        fields=None):
+        """
+        Wrapper to find a page of nodes and the token to continue from with the next page
+        """
+        return await self.database.find_page(collection_name, query, limit, page_token, fields)
+
+    async def read_head(self):
+        """
+        Reads the head from the database and refreshes the cached head with it. Proposals
+        from other nodes are checked against this rather than the cached head, which may
+        still hold the head from before another node committed.
+        """
+        head = await self.database.get_head()
+        chain_head.set(head)
+        return head
+
+    async def get_head(self):
+        """Hash and height of the head of the chain, served from the chain head cache"""
+        return await chain_head.get_async(self.database.get_head)
+
+
+def get_async_blockchain():
+    """
+    App scoped dependency returning the AsyncBlockchain shared by every request in the
+    process.
+    """
+    global _async_blockchain
+
+    if _async_blockchain is None:
+        with _async_blockchain_lock:
+            if _async_blockchain is None:
+                _async_blockchain = AsyncBlockchain()
+
+    return _async_blockchain
+
+
+def close_async_blockchain():
+    """Shutdown hook to drop the shared AsyncBlockchain"""
+    global _async_blockchain
+
+    with _async_blockchain_lock:
+        _async_blockchain = None
+
+
+async def confer_with_nodes(nodes, path, content, expected_result, node_count=None):
+    """
+    Sends the content to every node and counts the nodes responding with the expected
+    result. Resolves as soon as the quorum is reached or can no longer be reached and
+    cancels any outstanding requests. The quorum is taken of node_count when given, so
+    nodes left out for failing their health check still count as disagreeing.
+    """
+    logging.debug(f'Using nodes: {nodes}')
+
+    if node_count is None:
+        node_count = len(nodes)
+
+    required_nodes = get_required_node_count(node_count, QUORUM_RATIO)
+    successful_nodes = 0
+    outstanding_requests_tasks = {
+        asyncio.ensure_future(confer_with_node_request(node, path, content)) for node in nodes}
+
+    try:
+        while len(outstanding_requests_tasks) > 0:
+            done, outstanding_requests_tasks = await asyncio.wait(
+                outstanding_requests_tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                if is_successful_node_result(task.result(), expected_result):
+                    logging.debug('Adding successful validated node')
+                    successful_nodes += 1
+
+            if successful_nodes >= required_nodes:
+                break
+
+            if successful_nodes + len(outstanding_requests_tasks) < required_nodes:
+                break
+    finally:
+        for task in outstanding_requests_tasks:
+            task.cancel()
+
+    logging.debug(f'Successful Nodes: {successful_nodes} Required Nodes: {required_nodes}')
+
+    return successful_nodes >= required_nodes
+
+
+async def confer_with_node_request(node, path, content):
+    """
+    Dispatchs the proposed block or blocks for another node to confirm the hash is valid
+    """
+    logging.info(f'Attempting to confirm with node at address: \
+                    {node}{path} and payload: {content}')
+
+    return await peer_sessions.post(node, path, content)
+
+
+def get_required_node_count(node_count, quorum_ratio):
+    """
+    Smallest number of agreeing nodes whose share of all nodes is strictly greater than
+    the quorum ratio
+    """
+    return min(node_count, math.floor(node_count * quorum_ratio) + 1)
+
+
+def is_successful_node_result(result, expected_result):
+    """Checks the node responded with the same hash, or list of hashes, as this node"""
+    if result is None:
+        return False
+
+    logging.info(f'status code: {result.status_code} hash: {result.text}')
+    logging.debug(f'Current hash: {expected_result} Conferral Node hash: {result.text}')
+
+    if result.status_code != 200:
+        return False
+
+    try:
+        return result.json() == expected_result
+    except ValueError:
+        return False
@@ -0,0 +1,422 @@
+"""Class to handle mongodb database asynchronously"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from .models import Block
+from .bloom import key_filters
+from .mongo import MongoDb, AUDIT_BATCH_SIZE, MAX_PAGE_SIZE, ILLEGAL_OPERATION_ERROR_CODE, \
+    BLOCK_INDEXES, CreateBlockAlreadyExistsError, BlockHeightConflictError, \
+    get_current_document_query, check_expected_hash_id, get_connection_settings, \
+    get_client_settings, register_collection, needs_collection_indexes, mark_collection_indexed, \
+    are_transactions_supported, disable_transactions, get_data_key_query, get_data_key_document, \
+    get_data_write_operations, get_cached_verified_results, get_cached_verified_projections, \
+    verify_query_results, strip_query_result, encode_page_token, get_page_query, get_page_size, \
+    get_projection, is_projected_on_server, project_document, select_projected_results, \
+    get_as_of_query, split_history_rows, join_history_entries, get_proven_projections, \
+    get_proof_candidate_hashes, get_field_proof
+
+
+_async_clients = {}
+
+
+def get_async_client(connection_string):
+    """
+    Returns the motor client for the connection string on the running event loop, creating
+    it on first use there. A motor client is bound to the loop it is used from, so request
+    handlers and the shared loop commits run on each get their own pool. Motor is only
+    imported here, so it is needed once the async storage is used rather than to import
+    the package.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get((connection_string, loop))
+
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        logging.info('Creating shared async MongoClient connection pool')
+        client = AsyncIOMotorClient(connection_string, io_loop=loop, **get_client_settings())
+        _async_clients[(connection_string, loop)] = client
+
+    return client
+
+
+def close_async_connection_pool():
+    """Shutdown hook to close every shared motor client"""
+    for client in _async_clients.values():
+        client.close()
+    _async_clients.clear()
+
+
+class AsyncMongoDb:
+    """
+    Reads and writes of the documents and blocks, awaited on motor. Blockchain reaches these
+    through AsyncBlockchain; the synchronous maintenance of the database is in MongoDb.
+    """
+    def __init__(self):
+        self.connection_string, self.database_name = get_connection_settings()
+
+    def __get_database(self):
+        return get_async_client(self.connection_string)[self.database_name]
+
+    async def get_head(self):
+        """Returns the hash and height of the block at the head of the chain"""
+        latest_block = await self.__get_database().Blocks.find_one(
+            {}, sort=[('height', -1)], projection={'hash': 1, 'height': 1})
+
+        if latest_block is None:
+            return '', -1
+
+        if 'height' not in latest_block and await asyncio.get_running_loop().run_in_executor(
+                None, MongoDb().backfill_block_heights) > 0:
+            return await self.get_head()
+
+        return latest_block['hash'], latest_block.get('height')
+
+    async def commit_block(self, block: Block, expected_hash_id=None):
+        """
+        Adds the block to the chain and its data to the data collection, marking earlier
+        data for the same key as superceded. The writes are done in a single multi document
+        transaction when the deployment supports them and with an ordered bulk write
+        otherwise. When expected_hash_id is given the commit is refused with a
+        CommitConflictError unless the current data for the key is at that hash. Returns
+        the milliseconds taken by each phase of this commit, which are also logged.
+        """
+        database = self.__get_database()
+        timings = {}
+
+        if needs_collection_indexes('Blocks'):
+            # The unique height index is what refuses a block chained onto a stale head, so
+            # it is in place before the first block is written by this process
+            await database.Blocks.create_indexes(BLOCK_INDEXES)
+            mark_collection_indexed('Blocks')
+
+        if block.previous_hash == '':
+            try:
+                await database.Blocks.insert_one(block.get_naked_block().get_document())
+            except DuplicateKeyError as error:
+                raise BlockHeightConflictError(block.height) from error
+            logging.info("Genisys block created")
+            return timings
+
+        if needs_collection_indexes(block.data_collection_name):
+            # Backfilling the keys of a collection scans it, so it runs once per process
+            # off the loop
+            register_collection(block.data_collection_name, block.data_key_field_name)
+            await asyncio.get_running_loop().run_in_executor(
+                None, MongoDb().ensure_collection_indexes, block.data_collection_name,
+                block.data_key_field_name)
+
+        if are_transactions_supported():
+            try:
+                async with await get_async_client(self.connection_string).start_session() \
+                        as session:
+                    await session.with_transaction(
+                        lambda transaction_session: self.__write_block(
+                            database, block, transaction_session, expected_hash_id, timings))
+                self.__finish_commit(block, timings)
+                return timings
+            except OperationFailure as error:
+                if error.code != ILLEGAL_OPERATION_ERROR_CODE:
+                    raise
+                disable_transactions()
+
+        await self.__write_block(database, block, None, expected_hash_id, timings)
+        self.__finish_commit(block, timings)
+        return timings
+
+    def __finish_commit(self, block: Block, timings):
+        if block.block_type == 'CREATE':
+            key_filters.add(block.data_collection_name, block.data_key_value)
+
+        self.__log_commit_timings(block, timings)
+
+    async def __write_block(self, database, block: Block, session, expected_hash_id, timings):
+        if expected_hash_id is not None:
+            with self.__time_phase(timings, 'expected_hash_check'):
+                current_document = await database[block.data_collection_name].find_one(
+                    filter=get_current_document_query(block.data_key_field_name,
+                                                      block.data_key_value),
+                    projection={'hash_id': 1}, session=session)
+
+            check_expected_hash_id(block, current_document, expected_hash_id)
+
+        if block.block_type == 'CREATE':
+            with self.__time_phase(timings, 'create_check'):
+                try:
+                    await database.DataKeys.insert_one(get_data_key_document(block),
+                                                       session=session)
+                except DuplicateKeyError as error:
+                    raise CreateBlockAlreadyExistsError(block.data_key_field_name,
+                                                        str(block.data_key_value)) from error
+
+        try:
+            with self.__time_phase(timings, 'block_insert'):
+                try:
+                    await database.Blocks.insert_one(block.get_naked_block().get_document(),
+                                                     session=session)
+                except DuplicateKeyError as error:
+                    raise BlockHeightConflictError(block.height) from error
+
+            with self.__time_phase(timings, 'data_write'):
+                await database[block.data_collection_name].bulk_write(
+                    get_data_write_operations(block), ordered=True, session=session)
+        except Exception:
+            if session is None and block.block_type == 'CREATE':
+                await database.DataKeys.delete_one(
+                    {**get_data_key_query(block.data_collection_name, block.data_key_value),
+                     'hash_id': block.hash})
+            raise
+
+    @contextmanager
+    def __time_phase(self, timings, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[phase] = (time.perf_counter() - start) * 1000
+
+    def __log_commit_timings(self, block: Block, timings):
+        formatted_timings = ', '.join(f'{phase}: {duration:.2f}ms'
+                                      for phase, duration in timings.items())
+        logging.debug(f'Commit timings for block {block.hash}: {formatted_timings}')
+
+    async def data_key_exists(self, data_collection_name, data_key_value):
+        """Whether a CREATE block has been committed for the key"""
+        return await self.__get_database().DataKeys.find_one(
+            get_data_key_query(data_collection_name, data_key_value),
+            projection={'_id': 1}) is not None
+
+    async def get_current_hash_id(self, collection_name, data_key_field_name, data_key_value):
+        """Hash of the block holding the current data for the key, or None"""
+        current_document = await self.__get_database()[collection_name].find_one(
+            filter=get_current_document_query(data_key_field_name, data_key_value),
+            projection={'hash_id': 1})
+
+        return None if current_document is None else current_document['hash_id']
+
+    def __find_base(self, collection_name, query, fields=None):
+        query['superceded'] = False
+
+        return self.__get_database()[collection_name].find(
+            filter=query, projection=get_projection(fields if is_projected_on_server(fields)
+                                                    else None))
+
+    async def find_one(self, collection_name, query, fields=None):
+        """
+        Returns the newest verified document matching the query. When fields is given only
+        those fields are returned, and read when blocks are version 3, see
+        is_projected_on_server.
+        """
+        sorted_result = await self.__find_base(collection_name, query, fields) \
+                                  .sort([("_id", -1)]).limit(1).to_list(1)
+        results = await self.__audit_rows(collection_name, sorted_result, fields)
+
+        if len(results) == 0:
+            return None
+        return results[0]
+
+    async def find_one_with_hash_id(self, collection_name, query):
+        """
+        Returns the verified document matching the query and the hash of the block it was
+        committed in, or (None, None)
+        """
+        sorted_result = await self.__find_base(collection_name, query) \
+                                  .sort([("_id", -1)]).limit(1).to_list(1)
+
+        if len(sorted_result) == 0:
+            return None, None
+
+        hash_id = sorted_result[0]['hash_id']
+        result = await self.audit_result(strip_query_result(sorted_result[0]))
+
+        if result is None:
+            return None, None
+        return result, hash_id
+
+    async def get_field_proof(self, collection_name, query, field):
+        """
+        Returns a proof that the top level field of the newest document matching the query
+        is committed to by the chain, checked with verify_field_proof without access to the
+        database. None when there is no such document or its block is not a version 3 block.
+        """
+        document = await self.__get_database()[collection_name].find_one(
+            filter={**query, 'superceded': False}, sort=[('_id', -1)],
+            projection={field: 1, f'data_proofs.{field}': 1, 'hash_id': 1})
+
+        if document is None:
+            return None
+
+        block = await self.__get_database().Blocks.find_one({'hash': document['hash_id']},
+                                                            projection={'_id': 0})
+        return get_field_proof(document, block, field)
+
+    async def find(self, collection_name, query, fields=None):
+        return [result async for result in self.find_iter(collection_name, query, fields)]
+
+    async def find_one_as_of(self, collection_name, query, at):
+        """
+        Returns the verified version of the document matching the query as it was at the
+        block height or datetime at, superceded or not, or None if it did not exist yet.
+        The query should select a single key.
+        """
+        as_of_query, sort = get_as_of_query(query, at)
+        rows = await self.__get_database()[collection_name] \
+                         .find(filter=as_of_query, projection=get_projection(None)) \
+                         .sort(sort).limit(1).to_list(1)
+        results = await self.__audit_rows(collection_name, rows, None)
+
+        if len(results) == 0:
+            return None
+        return results[0]
+
+    async def find_history(self, collection_name, data_key_field_name, data_key_value,
+                           batch_size=AUDIT_BATCH_SIZE):
+        """
+        Yields every verified version of the document for the key, oldest first, as a tuple
+        of the block height, the block timestamp and the document
+        """
+        cursor = self.__get_database()[collection_name] \
+                     .find(filter={data_key_field_name: str(data_key_value)},
+                           projection=get_projection(None)) \
+                     .sort([('block_height', ASCENDING)]).batch_size(batch_size)
+        batch = []
+
+        async for row in cursor:
+            batch.append(row)
+
+            if len(batch) == batch_size:
+                for entry in await self.__audit_history_rows(batch):
+                    yield entry
+                batch = []
+
+        if len(batch) > 0:
+            for entry in await self.__audit_history_rows(batch):
+                yield entry
+
+    async def __audit_history_rows(self, rows):
+        metadata, documents = split_history_rows(rows)
+        return join_history_entries(metadata, await self.audit_results(documents))
+
+    async def find_iter(self, collection_name, query, fields=None, batch_size=AUDIT_BATCH_SIZE):
+        """
+        Yields the verified documents matching the query, newest first, reading from the
+        cursor and auditing batch_size documents at a time so memory stays bounded
+        """
+        cursor = self.__find_base(collection_name, query, fields).sort([("_id", -1)]) \
+                     .batch_size(batch_size)
+        batch = []
+
+        async for result in cursor:
+            batch.append(result)
+
+            if len(batch) == batch_size:
+                for verified_result in await self.__audit_rows(collection_name, batch, fields):
+                    yield verified_result
+                batch = []
+
+        if len(batch) > 0:
+            for verified_result in await self.__audit_rows(collection_name, batch, fields):
+                yield verified_result
+
+    async def find_page(self, collection_name, query, limit=MAX_PAGE_SIZE, page_token=None,
+                        fields=None):
+        """
+        Returns up to limit verified documents matching the query, newest first, starting
+        after page_token, and the token for the next page or None on the last page. limit
+        is capped at FIND_MAX_PAGE_SIZE. Documents that fail their audit are left out so a
+        page can hold fewer than limit documents.
+        """
+        limit = get_page_size(limit)
+        rows = await self.__find_base(collection_name, get_page_query(query, page_token), fields) \
+                         .sort([("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+        next_page_token = encode_page_token(rows[limit - 1]['_id']) if len(rows) > limit else None
+
+        return await self.__audit_rows(collection_name, rows[:limit], fields), next_page_token
+
+    async def __audit_rows(self, collection_name, rows, fields):
+        if is_projected_on_server(fields):
+            return await self.audit_projected_results(collection_name, rows, fields)
+
+        results = await self.audit_results([strip_query_result(row) for row in rows])
+
+        if fields is None:
+            return results
+        return [project_document(result, fields) for result in results]
+
+    async def audit_result(self, query_result):
+        results = await self.audit_results([query_result])
+
+        if len(results) == 0:
+            return None
+        return results[0]
+
+    async def audit_results(self, query_results):
+        """
+        Verifies each result against the block it references. Results already verified
+        recently are served from the audit cache, the blocks for the rest are fetched up
+        front in batched $in queries rather than one lookup per result.
+        """
+        verified_results = get_cached_verified_results(query_results)
+        blocks = await self.__get_blocks_by_hash([result['hash_id'] for result in query_results
+                                                  if id(result) not in verified_results])
+
+        return verify_query_results(query_results, blocks, verified_results)
+
+    async def audit_projected_results(self, collection_name, query_results, fields):
+        """
+        Verifies results holding only the projected fields, as read while version 3 blocks
+        are committed. Results whose fields match a recently verified document are accepted
+        from the audit cache and results of version 3 blocks are verified with the Merkle
+        proofs of their fields. A projection of an older block cannot be hashed, so the full
+        documents of the rest are fetched once, by _id, audited and projected.
+        """
+        verified_results = get_cached_verified_projections(query_results, fields)
+        proven_projections = get_proven_projections(
+            query_results,
+            await self.__get_blocks_by_hash(get_proof_candidate_hashes(query_results,
+                                                                       verified_results)),
+            fields)
+        full_documents = await self.__get_documents_by_id(
+            collection_name, [result['_id'] for result in query_results
+                              if id(result) not in verified_results
+                              and result['_id'] not in proven_projections])
+        projections = {document_id: project_document(document, fields)
+                       for document_id, document in full_documents.items()}
+        audited = {id(document) for document in await self.audit_results(
+            [strip_query_result(document) for document in full_documents.values()])}
+
+        return select_projected_results(
+            query_results, verified_results,
+            {**proven_projections,
+             **{document_id: projections[document_id]
+                for document_id, document in full_documents.items() if id(document) in audited}},
+            fields)
+
+    async def __get_documents_by_id(self, collection_name, document_ids):
+        collection = self.__get_database()[collection_name]
+        documents = {}
+
+        for index in range(0, len(document_ids), AUDIT_BATCH_SIZE):
+            batch = document_ids[index:index + AUDIT_BATCH_SIZE]
+            async for document in collection.find(filter={'_id': {'$in': batch}},
+                                                  projection={'block_type': 0}):
+                documents[document['_id']] = document
+
+        return documents
+
+    async def __get_blocks_by_hash(self, hashes):
+        database = self.__get_database()
+        unique_hashes = list(dict.fromkeys(hashes))
+        blocks = {}
+
+        for index in range(0, len(unique_hashes), AUDIT_BATCH_SIZE):
+            batch = unique_hashes[index:index + AUDIT_BATCH_SIZE]
+            async for block in database.Blocks.find(filter={"hash": {"$in": batch}},
+                                                    projection={'_id': 0}):
+                blocks[block['hash']] = block
+
+        return blocks
@@ -0,0 +1,130 @@
+"""Full re-hash audit of the data stored against the blockchain"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .models import HASH_VERSION_LEGACY, generate_audit_block
+
+
+MAX_REPORTED_MISMATCHES = 1000
+
+_audit_lock = threading.Lock()
+
+
+class AuditAlreadyRunningError(Exception):
+    def __init__(self):
+        self.message = 'A chain audit is already running in this process'
+
+
+def verify_block_chunk(chunk):
+    """
+    Recomputes the hash of each block from its stored data document and returns the
+    blocks whose hash no longer matches. Runs in a worker process.
+    """
+    mismatches = []
+
+    for block, document in chunk:
+        proposed_hash = generate_audit_block(block['id'], document, block['block_type'],
+                                             block['timestamp'], block['previous_hash'],
+                                             block.get('hash_version', HASH_VERSION_LEGACY)).hash
+
+        if proposed_hash != block['hash']:
+            mismatches.append({'hash': block['hash'], 'computed_hash': proposed_hash})
+
+    return mismatches
+
+
+class ChainAuditReport:
+    def __init__(self):
+        self.blocks_checked = 0
+        self.mismatch_count = 0
+        self.mismatches = []
+        self.missing_documents = []
+        self.elapsed_seconds = 0.0
+
+    def add_mismatches(self, mismatches):
+        self.mismatch_count += len(mismatches)
+        self.mismatches.extend(mismatches[:MAX_REPORTED_MISMATCHES - len(self.mismatches)])
+
+    def add_missing_document(self, block_hash):
+        if len(self.missing_documents) < MAX_REPORTED_MISMATCHES:
+            self.missing_documents.append(block_hash)
+
+    @property
+    def is_valid(self):
+        return self.mismatch_count == 0 and len(self.missing_documents) == 0
+
+    def to_dict(self):
+        return {
+            'is_valid': self.is_valid,
+            'blocks_checked': self.blocks_checked,
+            'mismatch_count': self.mismatch_count,
+            'mismatches': self.mismatches,
+            'missing_documents': self.missing_documents,
+            'elapsed_seconds': self.elapsed_seconds,
+            'blocks_per_second': self.blocks_checked / self.elapsed_seconds
+                                 if self.elapsed_seconds > 0 else 0.0,
+        }
+
+
+def audit_chain(database, workers=None, chunk_size=1000):
+    """
+    Streams every block with its data document from the database, in chunks, and fans the
+    re-hashing out across a process pool. Only a bounded number of chunks are in flight at
+    once so memory does not grow with the length of the chain, and each chunk looks its
+    documents up through the hash_id index of every data collection. Only one audit runs
+    in the process at a time, another raises an AuditAlreadyRunningError.
+    """
+    if not _audit_lock.acquire(blocking=False):
+        raise AuditAlreadyRunningError()
+
+    try:
+        return _audit_chain(database, workers, chunk_size)
+    finally:
+        _audit_lock.release()
+
+
+def _audit_chain(database, workers, chunk_size):
+    workers = workers or os.cpu_count() or 1
+    report = ChainAuditReport()
+    start = time.perf_counter()
+    outstanding_chunks = deque()
+
+    collection_names = database.get_data_collection_names()
+    database.ensure_hash_id_indexes(collection_names)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for blocks in database.get_block_batches(chunk_size):
+            documents = database.get_documents_by_hash([block['hash'] for block in blocks],
+                                                       collection_names)
+            chunk = []
+
+            for block in blocks:
+                if block['previous_hash'] == '':
+                    continue
+
+                document = documents.get(block['hash'])
+
+                if document is None:
+                    report.add_missing_document(block['hash'])
+                    continue
+
+                chunk.append((block, document))
+
+            report.blocks_checked += len(chunk)
+            outstanding_chunks.append(executor.submit(verify_block_chunk, chunk))
+
+            while len(outstanding_chunks) >= workers * 2:
+                report.add_mismatches(outstanding_chunks.popleft().result())
+
+        while len(outstanding_chunks) > 0:
+            report.add_mismatches(outstanding_chunks.popleft().result())
+
+    report.elapsed_seconds = time.perf_counter() - start
+    logging.info(f'Chain audit checked {report.blocks_checked} blocks in '
+                 f'{report.elapsed_seconds:.2f}s with {report.mismatch_count} mismatches')
+
+    return report
@@ -0,0 +1,169 @@
+"""Caches used by the blockchain to avoid repeating work on hot paths"""
+
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class AuditCache:
+    """
+    Bounded LRU cache with a time to live of the documents, keyed by their hash_id, that
+    have already been verified against the blockchain. A row is only trusted while it is
+    equal to the cached document, so a cache hit is a dict comparison rather than a hash.
+    Entries expire after the ttl.
+    """
+    def __init__(self, max_size=10000, ttl_seconds=60.0, enabled=True):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled and max_size > 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, hash_id):
+        """Returns the document verified for the hash_id or None if not cached"""
+        if not self.enabled:
+            return None
+
+        with self.__lock:
+            entry = self.__entries.get(hash_id)
+
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.__entries[hash_id]
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(hash_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, hash_id, document):
+        """
+        Records the document verified for the hash_id, evicting the oldest entry if full.
+        The document must not be shared with a caller that may modify it.
+        """
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            self.__entries[hash_id] = (document, time.monotonic() + self.ttl_seconds)
+            self.__entries.move_to_end(hash_id)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns the current size and hit/miss counters of the cache"""
+        return {
+            'enabled': self.enabled,
+            'size': len(self.__entries),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the cache from AUDIT_CACHE_SIZE, AUDIT_CACHE_TTL_SECONDS and
+        AUDIT_CACHE_ENABLED. Setting AUDIT_CACHE_ENABLED to false opts out of caching.
+        """
+        return cls(int(os.environ.get('AUDIT_CACHE_SIZE', 10000)),
+                   float(os.environ.get('AUDIT_CACHE_TTL_SECONDS', 60)),
+                   os.environ.get('AUDIT_CACHE_ENABLED', 'true').lower() != 'false')
+
+
+audit_cache = AuditCache.from_environment()
+
+
+class ChainHeadCache:
+    """
+    In process cache of the hash and height at the head of the chain. Local commits update it
+    directly, otherwise it is refreshed after ttl_seconds. When a watcher is running the
+    head is pushed by the watcher on every inserted block and the ttl is not used.
+    """
+    def __init__(self, ttl_seconds=1.0):
+        self.ttl_seconds = ttl_seconds
+        self.__head = None
+        self.__expires = 0.0
+        self.__lock = threading.Lock()
+        self.__watcher = None
+        self.__stream = None
+
+    @property
+    def is_watching(self):
+        return self.__watcher is not None and self.__watcher.is_alive()
+
+    async def get_async(self, load_head):
+        """Returns the cached head, awaiting load_head to refresh it when missing or expired"""
+        with self.__lock:
+            if self.__head is not None and (self.is_watching or self.__expires > time.monotonic()):
+                return self.__head
+
+        head = await load_head()
+        self.set(head)
+        return head
+
+    def set(self, head):
+        with self.__lock:
+            self.__head = head
+            self.__expires = time.monotonic() + self.ttl_seconds
+
+    def invalidate(self):
+        with self.__lock:
+            self.__head = None
+            self.__expires = 0.0
+
+    def start_watching(self, watch):
+        """
+        Starts a daemon thread that consumes the change stream returned by watch and
+        updates the head for every inserted block
+        """
+        if self.is_watching:
+            return
+
+        self.invalidate()
+        self.__stream = watch()
+        self.__watcher = threading.Thread(target=self.__watch, name='chain-head-watcher',
+                                          daemon=True)
+        self.__watcher.start()
+
+    def stop_watching(self):
+        stream = self.__stream
+        self.__stream = None
+
+        if stream is not None:
+            stream.close()
+
+        self.__watcher = None
+        self.invalidate()
+
+    def __watch(self):
+        stream = self.__stream
+        try:
+            for change in stream:
+                self.set((change['fullDocument']['hash'], change['fullDocument'].get('height')))
+        except Exception as error:
+            if self.__stream is not None:
+                logging.error(f'Chain head watcher stopped: {error}')
+        finally:
+            self.invalidate()
+
+    @classmethod
+    def from_environment(cls):
+        """Creates the cache using CHAIN_HEAD_CACHE_TTL_SECONDS for the ttl"""
+        return cls(float(os.environ.get('CHAIN_HEAD_CACHE_TTL_SECONDS', 1.0)))
+
+
+chain_head = ChainHeadCache.from_environment()
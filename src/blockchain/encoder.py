@@ -0,0 +1,99 @@
+"""JSON encoding of the objects that are stored on the blockchain"""
+
+import json
+import uuid
+from enum import Enum
+from datetime import datetime
+from pydantic import BaseModel
+
+
+_encoders = {}
+_dispatch_cache = {}
+
+
+def register_encoder(cls):
+    """
+    Decorator that registers the decorated function as the JSON encoder for instances of
+    cls and its subclasses
+    """
+    def decorator(function):
+        _encoders[cls] = function
+        _dispatch_cache.clear()
+        return function
+    return decorator
+
+
+def get_encoder(cls):
+    """
+    Returns the encoder registered for the closest class in the method resolution order of
+    cls. The result is cached per type so the lookup only happens once.
+    """
+    try:
+        return _dispatch_cache[cls]
+    except KeyError:
+        pass
+
+    encoder = next((_encoders[base] for base in cls.__mro__ if base in _encoders), None)
+    _dispatch_cache[cls] = encoder
+    return encoder
+
+
+class HelperEncoder(json.JSONEncoder):
+    """
+    Helper for JSON encoding of classes using the registered encoders
+    """
+    def default(self, o):
+        encoder = get_encoder(type(o))
+
+        if encoder is None:
+            return json.JSONEncoder.default(self, o)
+
+        return encoder(o)
+
+
+def iter_json_array(documents):
+    """
+    Yields the documents as consecutive chunks of one JSON array, so a streamed response only
+    ever holds a single encoded document
+    """
+    encoder = HelperEncoder()
+    separator = ''
+
+    yield '['
+    for document in documents:
+        yield separator + encoder.encode(document)
+        separator = ','
+    yield ']'
+
+
+async def aiter_json_array(documents):
+    """Asynchronous counterpart of iter_json_array for an async iterable of documents"""
+    encoder = HelperEncoder()
+    separator = ''
+
+    yield '['
+    async for document in documents:
+        yield separator + encoder.encode(document)
+        separator = ','
+    yield ']'
+
+
+@register_encoder(uuid.UUID)
+def encode_uuid(value):
+    return str(value)
+
+
+@register_encoder(datetime)
+def encode_datetime(value):
+    return value.isoformat()
+
+
+@register_encoder(Enum)
+def encode_enum(value):
+    return value.value
+
+
+@register_encoder(BaseModel)
+def encode_model(value):
+    """Returns the field values as they are, the json encoder walks them without copying"""
+    return value.__dict__
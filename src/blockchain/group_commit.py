@@ -0,0 +1,90 @@
+"""Group commit of concurrently submitted transactions"""
+
+import os
+import asyncio
+import logging
+
+
+class PendingTransaction:
+    def __init__(self, blockchain, transaction):
+        self.blockchain = blockchain
+        self.transaction = transaction
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class GroupCommitter:
+    """
+    Collects transactions submitted within a short window and commits them through
+    AsyncBlockchain.commit_transactions so a whole run of blocks is conferred with the other
+    nodes in one round. Callers await the result of their own transaction, so a batch is
+    only bounded by max_batch_size and not by a number of waiting threads.
+    """
+    def __init__(self, enabled=False, window_seconds=0.005, max_batch_size=50):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.__queue = None
+        self.__worker = None
+
+    async def submit(self, blockchain, transaction):
+        """
+        Queues the transaction, a tuple of the commit_transaction arguments, and waits for
+        it to be committed. Returns True or False, or raises the error from its commit.
+        """
+        pending_transaction = PendingTransaction(blockchain, transaction)
+        self.__ensure_worker()
+        self.__queue.put_nowait(pending_transaction)
+        return await pending_transaction.future
+
+    def __ensure_worker(self):
+        if self.__worker is None or self.__worker.done() \
+                or self.__worker.get_loop() is not asyncio.get_running_loop():
+            self.__queue = asyncio.Queue()
+            self.__worker = asyncio.ensure_future(self.__run())
+
+    async def __run(self):
+        while True:
+            batch = [await self.__queue.get()]
+
+            if self.__queue.qsize() + 1 < self.max_batch_size:
+                await asyncio.sleep(self.window_seconds)
+
+            while len(batch) < self.max_batch_size and not self.__queue.empty():
+                batch.append(self.__queue.get_nowait())
+
+            await self.__commit_batch(batch)
+
+    @staticmethod
+    async def __commit_batch(batch):
+        logging.info(f'Group committing {len(batch)} transactions')
+
+        try:
+            results = await batch[0].blockchain.commit_transactions(
+                [pending_transaction.transaction for pending_transaction in batch])
+        except Exception as error:
+            for pending_transaction in batch:
+                if not pending_transaction.future.done():
+                    pending_transaction.future.set_exception(error)
+            return
+
+        for pending_transaction, result in zip(batch, results):
+            if pending_transaction.future.done():
+                continue
+
+            if isinstance(result, Exception):
+                pending_transaction.future.set_exception(result)
+            else:
+                pending_transaction.future.set_result(result)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the committer from GROUP_COMMIT_ENABLED, GROUP_COMMIT_WINDOW_MS and
+        GROUP_COMMIT_MAX_BATCH_SIZE
+        """
+        return cls(os.environ.get('GROUP_COMMIT_ENABLED', 'false').lower() == 'true',
+                   float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5)) / 1000,
+                   int(os.environ.get('GROUP_COMMIT_MAX_BATCH_SIZE', 50)))
+
+
+group_committer = GroupCommitter.from_environment()
@@ -0,0 +1,232 @@
+"""Background discovery and health checking of the other nodes in the network"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+import requests
+import boto3
+from .peers import peer_sessions
+
+
+class StaticDiscovery:
+    """Discovers a fixed list of node addresses"""
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+
+    def discover(self):
+        return list(self.nodes)
+
+    @classmethod
+    def from_environment(cls):
+        """Creates the discovery from the json list in NODES"""
+        if 'NODES' in os.environ and len(os.environ['NODES']) > 0:
+            return cls(json.loads(os.environ['NODES']))
+        return cls([])
+
+
+class FileDiscovery:
+    """
+    Discovers the node addresses listed in a json file. The file is read on every refresh so
+    a local stand-in for service discovery only has to rewrite it.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def discover(self):
+        with open(self.path) as nodes_file:
+            return json.load(nodes_file)
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ['NODES_FILE'])
+
+
+class AwsCloudMapDiscovery:
+    """
+    Discovers the other instances registered with AWS Cloud Map, excluding the container
+    this node runs in
+    """
+    def __init__(self, metadata_uri):
+        self.metadata_uri = metadata_uri
+        self.__client = None
+        self.__container_ip = None
+
+    def discover(self):
+        if self.__client is None:
+            self.__client = boto3.client('servicediscovery')
+
+        if self.__container_ip is None:
+            container_metadata = requests.get(self.metadata_uri).json()
+            self.__container_ip = container_metadata['Networks'][0]['IPv4Addresses'][0]
+
+        node_ips = []
+        for service in self.__client.list_services()['Services']:
+            for instance in self.__client.list_instances(
+                ServiceId=service['Id'],
+                MaxResults=100
+            )['Instances']:
+                if self.__container_ip != instance['Attributes']['AWS_INSTANCE_IPV4']:
+                    node_ips.append(instance['Attributes']['AWS_INSTANCE_IPV4'])
+        return node_ips
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ['ECS_CONTAINER_METADATA_URI'])
+
+
+DISCOVERY_SOURCES = {
+    'static': StaticDiscovery,
+    'file': FileDiscovery,
+    'aws': AwsCloudMapDiscovery,
+}
+
+
+def get_discovery_from_environment():
+    """
+    Creates the discovery source named by NODE_DISCOVERY. Without it local and development
+    environments use the static NODES list and every other environment uses AWS Cloud Map.
+    """
+    source = os.environ.get('NODE_DISCOVERY')
+
+    if source is None:
+        if 'ENVIRONMENT' not in os.environ or os.environ['ENVIRONMENT'] == 'local' \
+            or os.environ['ENVIRONMENT'] == 'development':
+            source = 'static'
+        else:
+            source = 'aws'
+
+    return DISCOVERY_SOURCES[source.lower()].from_environment()
+
+
+class LazyDiscovery:
+    """Creates the wrapped discovery source the first time nodes are discovered"""
+    def __init__(self, create_discovery):
+        self.create_discovery = create_discovery
+        self.__discovery = None
+
+    def discover(self):
+        if self.__discovery is None:
+            self.__discovery = self.create_discovery()
+        return self.__discovery.discover()
+
+
+class Membership:
+    """
+    Cached snapshot of the nodes in the network. A daemon thread rediscovers the nodes every
+    refresh_seconds and health checks them, so readers never wait on discovery once the
+    first snapshot is taken. The snapshot is a tuple of every discovered node and the nodes
+    that passed their last health check; quorum is counted against all discovered nodes
+    while requests are only sent to the healthy ones, unless too few are healthy to reach it.
+    A snapshot taken on first use, which may be on the shared loop, is not health checked.
+    """
+    def __init__(self, discovery, refresh_seconds=30.0, health_check_path='/api/blockchain/ping',
+                 health_check_enabled=True):
+        self.discovery = discovery
+        self.refresh_seconds = refresh_seconds
+        self.health_check_path = health_check_path
+        self.health_check_enabled = health_check_enabled
+        self.__snapshot = None
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__refresher = None
+
+    @property
+    def is_refreshing(self):
+        return self.__refresher is not None and self.__refresher.is_alive()
+
+    @property
+    def nodes(self):
+        """Every discovered node"""
+        return self.get_snapshot()[0]
+
+    def get_snapshot(self):
+        """Returns the current (nodes, healthy_nodes), discovering them on first use"""
+        snapshot = self.__snapshot
+
+        if snapshot is None:
+            with self.__lock:
+                if self.__snapshot is None:
+                    self.__snapshot = self.__discover(check_health=False)
+                snapshot = self.__snapshot
+
+        return snapshot
+
+    def refresh(self):
+        """Rediscovers and health checks the nodes, keeping the last snapshot on failure"""
+        try:
+            snapshot = self.__discover()
+        except Exception as error:
+            logging.warning(f'Unable to refresh node membership: {error!r}')
+            return
+
+        with self.__lock:
+            self.__snapshot = snapshot
+
+    def start(self):
+        """Takes the first snapshot and starts the daemon thread that refreshes it"""
+        if self.is_refreshing:
+            return
+
+        self.refresh()
+        self.get_snapshot()
+
+        self.__stopped.clear()
+        self.__refresher = threading.Thread(target=self.__refresh_until_stopped,
+                                            name='membership-refresher', daemon=True)
+        self.__refresher.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__refresher = None
+
+    def __refresh_until_stopped(self):
+        while not self.__stopped.wait(self.refresh_seconds):
+            self.refresh()
+
+    def __discover(self, check_health=True):
+        nodes = tuple(self.discovery.discover())
+
+        if not check_health or not self.health_check_enabled or len(nodes) == 0:
+            return nodes, nodes
+
+        healthy_nodes = peer_sessions.run(self.__check_nodes(nodes))
+        dead_nodes = set(nodes) - set(healthy_nodes)
+
+        if len(dead_nodes) > 0:
+            logging.warning(f'Nodes failed health check: {sorted(dead_nodes)}')
+
+        logging.info(f'Using nodes: {nodes} of which healthy: {healthy_nodes}')
+
+        return nodes, healthy_nodes
+
+    async def __check_nodes(self, nodes):
+        responses = await asyncio.gather(*[peer_sessions.get(node, self.health_check_path)
+                                           for node in nodes])
+
+        return tuple(node for node, response in zip(nodes, responses)
+                     if response is not None and response.status_code == 200)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the membership from MEMBERSHIP_REFRESH_SECONDS, NODE_HEALTH_CHECK_PATH and
+        NODE_HEALTH_CHECK_ENABLED. The discovery source is only created on first use.
+        """
+        return cls(LazyDiscovery(get_discovery_from_environment),
+                   float(os.environ.get('MEMBERSHIP_REFRESH_SECONDS', 30.0)),
+                   os.environ.get('NODE_HEALTH_CHECK_PATH', '/api/blockchain/ping'),
+                   os.environ.get('NODE_HEALTH_CHECK_ENABLED', 'true').lower() != 'false')
+
+
+membership = Membership.from_environment()
+
+
+def start_membership_refresh():
+    """Startup hook to keep the node membership refreshed in the background"""
+    membership.start()
+
+
+def stop_membership_refresh():
+    membership.stop()
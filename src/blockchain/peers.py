@@ -0,0 +1,148 @@
+"""Pooled asynchronous http sessions used to confer with the other nodes"""
+
+import os
+import asyncio
+import logging
+import threading
+import httpx
+
+
+class PeerSessions:
+    """
+    Owns one long lived event loop, running on a daemon thread, and one pooled
+    httpx.AsyncClient per node so conferral requests reuse connections and are sent
+    concurrently instead of one after another. Commits run on this loop too, see
+    AsyncBlockchain, so the synchronous api blocks on it with run and iterate.
+    """
+    def __init__(self, timeout_seconds=5.0, max_connections=10):
+        self.timeout_seconds = timeout_seconds
+        self.max_connections = max_connections
+        self.__clients = {}
+        self.__loop = None
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def run(self, coroutine):
+        """Runs the coroutine on the shared loop and blocks the calling thread for its result"""
+        loop = self.__get_loop()
+
+        if threading.current_thread() is self.__thread:
+            coroutine.close()
+            raise RuntimeError('PeerSessions.run cannot block the shared loop it runs on')
+
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def run_async(self, coroutine):
+        """Runs the coroutine on the shared loop and awaits its result from the calling loop"""
+        loop = self.__get_loop()
+
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def iterate(self, async_iterator):
+        """
+        Yields the items of the async iterator, reading each of them on the shared loop and
+        blocking the calling thread until it is read
+        """
+        try:
+            while True:
+                has_item, item = self.run(get_next_item(async_iterator))
+
+                if not has_item:
+                    return
+                yield item
+        finally:
+            self.run(close_iterator(async_iterator))
+
+    async def post(self, node, path, content):
+        """
+        Posts the content to the node. Returns None if the node could not be reached or
+        did not respond within the timeout.
+        """
+        try:
+            return await self.__get_client(node).post(path, content=content)
+        except httpx.HTTPError as error:
+            logging.warning(f'Request to node {node}{path} failed: {error!r}')
+            return None
+
+    async def get(self, node, path):
+        """
+        Gets the path from the node. Returns None if the node could not be reached or
+        did not respond within the timeout.
+        """
+        try:
+            return await self.__get_client(node).get(path)
+        except httpx.HTTPError as error:
+            logging.warning(f'Request to node {node}{path} failed: {error!r}')
+            return None
+
+    def close(self):
+        """Closes every pooled client, cancels what is still running and stops the shared loop"""
+        with self.__lock:
+            loop = self.__loop
+            clients = list(self.__clients.values())
+            self.__clients.clear()
+            self.__loop = None
+            self.__thread = None
+
+        if loop is None:
+            return
+
+        async def close_clients():
+            await asyncio.gather(*[client.aclose() for client in clients])
+
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        asyncio.run_coroutine_threadsafe(close_clients(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def __get_loop(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever,
+                                                 name='peer-sessions', daemon=True)
+                self.__thread.start()
+            return self.__loop
+
+    def __get_client(self, node):
+        client = self.__clients.get(node)
+
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=node,
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections))
+            self.__clients[node] = client
+
+        return client
+
+    @classmethod
+    def from_environment(cls):
+        """Creates the sessions from PEER_REQUEST_TIMEOUT_SECONDS and PEER_MAX_CONNECTIONS"""
+        return cls(float(os.environ.get('PEER_REQUEST_TIMEOUT_SECONDS', 5.0)),
+                   int(os.environ.get('PEER_MAX_CONNECTIONS', 10)))
+
+
+async def get_next_item(async_iterator):
+    try:
+        return True, await async_iterator.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def close_iterator(async_iterator):
+    await async_iterator.aclose()
+
+
+peer_sessions = PeerSessions.from_environment()
+
+
+def close_peer_sessions():
+    """Shutdown hook to close the pooled peer connections"""
+    peer_sessions.close()